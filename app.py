@@ -1,20 +1,34 @@
-from flask import Flask, request, abort
+import time
+
+# 以 gunicorn --preload 啟動時，以下匯入只在 master 執行一次
+import_started = time.perf_counter()
+
+import asyncio
 import os
+import tempfile
 import pendulum
 import logging
-from linebot.v3.messaging import MessagingApi, ApiClient, Configuration
-from linebot.v3.webhook import WebhookHandler
-from linebot.v3.exceptions import InvalidSignatureError
+from linebot.v3.webhook import SignatureValidator, WebhookParser
 from linebot.v3.webhooks import MessageEvent, TextMessageContent
 from linebot.v3.messaging import TextMessage
-from supabase import create_client
-
-# 設置日誌
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from cache import TTLCache, create_event_id_store, create_invalidation_backend
+from clients import get_messaging_api, get_supabase, line_pool_stats, reply_message, supabase_stats
+from dispatcher import EventDispatcher
+from entries import build_row, parse_bulk, parse_expense
+from logging_setup import current_user_id, setup_logging, stop_logging
+from metrics import REGISTRY, current_command, timed
+from reports import paginate, render_export, render_month_report, render_year_report
+from rollups import fetch_month_total
+from spool import ExpenseSpool
+
+# 設置日誌：經由佇列非同步輸出，INFO 依 LOG_SAMPLE_RATE 抽樣，單筆最多 LOG_MAX_LENGTH 字
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    sample_rate=float(os.getenv("LOG_SAMPLE_RATE", 1.0)),
+    max_length=int(os.getenv("LOG_MAX_LENGTH", 500)),
+)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-
 # 從環境變數取得憑證
 channel_access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
 channel_secret = os.getenv("LINE_CHANNEL_SECRET")
@@ -25,95 +39,281 @@ if not all([channel_access_token, channel_secret, supabase_url, supabase_key]):
     logger.error("缺少必要的環境變數")
     raise ValueError("必須設置 LINE_CHANNEL_ACCESS_TOKEN, LINE_CHANNEL_SECRET, SUPABASE_URL, SUPABASE_KEY")
 
-# 初始化 LINE Bot 和 Supabase
-configuration = Configuration(access_token=channel_access_token)
-line_bot_api = ApiClient(configuration=configuration)
-messaging_api = MessagingApi(line_bot_api)
-handler = WebhookHandler(channel_secret)
-supabase = create_client(supabase_url, supabase_key)
+# 初始化 LINE Bot；LINE API 與 Supabase 的連線由 clients 在各 worker 內延遲建立
+# 簽章另外驗證以便分開計時，parser 只負責解析
+signature_validator = SignatureValidator(channel_secret)
+parser = WebhookParser(channel_secret, skip_signature_verification=lambda: True)
+
+DEFAULT_CATEGORIES = ["三餐", "加油", "掛號", "生活用品", "飲料","機車"]
+
+# 用戶類別快取：新增類別時寫入並廣播失效，其他 worker 透過 invalidation backend 同步
+category_cache = TTLCache(
+    maxsize=int(os.getenv("CATEGORY_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("CATEGORY_CACHE_TTL", 300)),
+)
+invalidation_backend = create_invalidation_backend(os.getenv("REDIS_URL"))
+
+# 已處理的 webhookEventId：LINE 逾時重送的事件在進入佇列前即略過，避免重複記帳
+event_id_store = create_event_id_store(
+    os.getenv("REDIS_URL"),
+    maxsize=int(os.getenv("EVENT_DEDUP_SIZE", 50000)),
+    ttl=float(os.getenv("EVENT_DEDUP_TTL", 86400)),
+)
+events_deduplicated = REGISTRY.counter(
+    "line_bot_webhook_events_deduplicated_total", "Webhook events skipped as duplicates", ("redelivery",)
+)
 
 def get_user_categories(user_id):
     """獲取用戶的自訂類別，並確保內建類別始終可用"""
-    default_categories = ["三餐", "加油", "掛號", "生活用品", "飲料","機車"]
+    categories = category_cache.get(user_id)
+    if categories is not None:
+        return list(categories)
     try:
-        response = supabase.table("categories").select("category_name").eq("user_id", user_id).execute()
+        with timed("supabase.categories.select"):
+            response = get_supabase().table("categories").select("category_name").eq("user_id", user_id).execute()
         user_categories = [row["category_name"] for row in response.data] if response.data else []
         # 合併自訂類別和內建類別，並去重
-        return list(set(user_categories + default_categories))
+        categories = frozenset(user_categories + DEFAULT_CATEGORIES)
     except Exception as e:
-        logger.error(f"Failed to fetch categories: {str(e)}")
-        return default_categories  # 若查詢失敗，返回內建類別
+        logger.error("Failed to fetch categories: %s", e)
+        return list(DEFAULT_CATEGORIES)  # 若查詢失敗，返回內建類別（不寫入快取）
+    category_cache.set(user_id, categories)
+    return list(categories)
 
 def add_user_category(user_id, category):
     """新增用戶自訂類別"""
-    response = supabase.table("categories").insert({
-        "user_id": user_id,
-        "category_name": category
-    }).execute()
-    return response.data is not None
-
-@app.route("/callback", methods=['POST'])
-def callback():
-    signature = request.headers.get('X-Line-Signature', '')
-    body = request.get_data(as_text=True)
-    logger.info(f"Received webhook body: {body}")
-
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
+    # (user_id, category_name) 有唯一限制，重複新增時略過
+    with timed("supabase.categories.upsert"):
+        response = get_supabase().table("categories").upsert({
+            "user_id": user_id,
+            "category_name": category
+        }, on_conflict="user_id,category_name", ignore_duplicates=True).execute()
+    if response.data is None:
+        return False
+    # 通知其他 worker 失效，本地快取則直接寫入新類別
+    categories = category_cache.peek(user_id)
+    invalidation_backend.publish(user_id)
+    if categories is not None:
+        category_cache.set(user_id, categories | {category})
+    return True
+
+def handle_event(event):
+    """在執行緒池中處理單一事件"""
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent):
+        handle_message(event)
+
+# 事件處理池：webhook 先回應 OK，事件再交由背景執行緒依用戶順序處理
+dispatcher = EventDispatcher(
+    handle_event,
+    max_workers=int(os.getenv("EVENT_WORKERS", 8)),
+    max_pending=int(os.getenv("EVENT_QUEUE_LIMIT", 256)),
+)
+# 關閉時處理剩餘事件與送出緩衝區共用的時限，需小於 gunicorn 的 --graceful-timeout（30 秒），
+# 並預留一次 Supabase 請求逾時的餘裕
+shutdown_timeout = float(os.getenv("SHUTDOWN_TIMEOUT", 20))
+
+def insert_expenses(rows):
+    """批次寫入 expenses；idempotency_key 重複（已寫入過）的資料直接略過"""
+    with timed("supabase.expenses.upsert", "spool_flush"):
+        get_supabase().table("expenses").upsert(rows, on_conflict="idempotency_key", ignore_duplicates=True).execute()
+
+# 記帳先寫入本地緩衝區，再由背景執行緒批次寫入 Supabase
+# 緩衝區檔案需放在重新部署後仍會保留的磁碟，否則未送出的記帳會在重啟時遺失
+if not os.getenv("EXPENSE_SPOOL_PATH"):
+    logger.warning("EXPENSE_SPOOL_PATH is not set: unflushed expenses in ./expense_spool.db are lost if the filesystem is ephemeral")
+expense_spool = ExpenseSpool(
+    os.getenv("EXPENSE_SPOOL_PATH", "expense_spool.db"),
+    insert_expenses,
+    batch_size=int(os.getenv("EXPENSE_SPOOL_BATCH", 500)),
+    linger=float(os.getenv("EXPENSE_SPOOL_LINGER", 0.2)),
+)
+
+# 多個 worker 的指標經由共用目錄合併輸出；--preload 時目錄在 master 建立，各 worker 共用
+REGISTRY.enable_multiprocess(os.getenv("METRICS_DIR") or tempfile.mkdtemp(prefix="line-bot-metrics-"))
+REGISTRY.callback("line_bot_category_cache_hits_total", "Category cache hits", lambda: category_cache.hits, "counter")
+REGISTRY.callback("line_bot_category_cache_misses_total", "Category cache misses", lambda: category_cache.misses, "counter")
+REGISTRY.callback("line_bot_category_cache_evictions_total", "Category cache evictions", lambda: category_cache.evictions, "counter")
+REGISTRY.callback("line_bot_spool_dead_rows", "Expenses moved to spool_dead after repeated rejection", expense_spool.dead_count)
+REGISTRY.callback("line_bot_pending_events", "Webhook events waiting or being processed", lambda: dispatcher.pending)
+REGISTRY.callback("line_bot_supabase_requests_total", "HTTP requests sent to PostgREST", lambda: supabase_stats.requests, "counter")
+REGISTRY.callback("line_bot_supabase_connections_total", "TCP connections opened to PostgREST", lambda: supabase_stats.connections, "counter")
+REGISTRY.callback("line_bot_supabase_connection_reuse_ratio", "Share of PostgREST requests sent on a reused connection", lambda: supabase_stats.reuse_ratio)
+REGISTRY.callback("line_bot_line_requests_total", "HTTP requests sent to the LINE API", lambda: line_pool_stats()[0], "counter")
+REGISTRY.callback("line_bot_line_connections_total", "TCP connections opened to the LINE API", lambda: line_pool_stats()[1], "counter")
+
+# 匯入耗時（--preload 時只發生在 master）與 worker 從 fork 到可接受請求的時間
+import_seconds = time.perf_counter() - import_started
+worker_started = import_started
+
+def mark_worker_started():
+    global worker_started
+    worker_started = time.perf_counter()
+
+os.register_at_fork(after_in_child=mark_worker_started)
+worker_startup_seconds = 0.0
+REGISTRY.callback("line_bot_import_seconds", "Time spent importing the app module", lambda: import_seconds)
+REGISTRY.callback("line_bot_worker_startup_seconds", "Time from worker start (or fork) to ready", lambda: worker_startup_seconds)
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+async def send_response(send, status, body=b"", content_type=b"text/plain; charset=utf-8"):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def deduplicate(events):
+    """略過已處理過的事件，回傳 (待處理事件, 本次認領的 webhookEventId)"""
+    event_ids = list(dict.fromkeys(event.webhook_event_id for event in events if getattr(event, "webhook_event_id", None)))
+    if not event_ids:
+        return events, []
+    with timed("dedup", "webhook"):
+        claimed = [event_id for event_id, ok in zip(event_ids, await event_id_store.claim(event_ids)) if ok]
+    remaining = set(claimed)
+    fresh = []
+    for event in events:
+        event_id = getattr(event, "webhook_event_id", None)
+        if event_id is None or event_id in remaining:
+            # 同一批內重複出現的 ID 只處理第一次
+            remaining.discard(event_id)
+            fresh.append(event)
+            continue
+        redelivery = bool(event.delivery_context and event.delivery_context.is_redelivery)
+        events_deduplicated.inc(redelivery=str(redelivery).lower())
+        logger.info("Skipping duplicate event %s (redelivery=%s)", event_id, redelivery)
+    return fresh, claimed
+
+async def callback(scope, receive, send):
+    headers = dict(scope["headers"])
+    signature = headers.get(b"x-line-signature", b"").decode()
+    body = (await read_body(receive)).decode("utf-8")
+    logger.debug("Received webhook body: %s", body)
+
+    with timed("signature", "webhook"):
+        valid = signature_validator.validate(body, signature)
+    if not valid:
         logger.error("Invalid signature")
-        abort(400)
+        await send_response(send, 400, b"Bad Request")
+        return
+    try:
+        events = parser.parse(body, signature)
     except Exception as e:
-        logger.error(f"Callback error: {str(e)}")
-        abort(500)
-    return 'OK'
+        logger.error("Callback error: %s", e)
+        await send_response(send, 500, b"Internal Server Error")
+        return
+
+    events, claimed = await deduplicate(events)
+    if events and not dispatcher.try_submit(events):
+        # 佇列已滿或正在關閉：回應 503，讓 LINE 稍後重送；釋放認領，重送時才不會被當成重複
+        await event_id_store.release(claimed)
+        logger.warning("Event queue full, rejecting %d events", len(events))
+        await send_response(send, 503, b"Service Unavailable")
+        return
+    await send_response(send, 200, b"OK")
+
+async def lifespan(receive, send):
+    global worker_startup_seconds
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # 在 worker 內訂閱，避免訂閱執行緒在 fork 之前建立
+            invalidation_backend.subscribe(category_cache.pop)
+            expense_spool.start()
+            REGISTRY.start_writer()
+            # 預先建立連線物件，避免第一個請求負擔初始化成本
+            get_supabase()
+            get_messaging_api()
+            if not event_id_store.shared and (worker_started != import_started or int(os.getenv("WEB_CONCURRENCY", 1)) > 1):
+                # 由 --preload 的 master fork 而來（或設定了多個 worker）：去重與類別快取失效都只在單一 worker 內有效
+                logger.warning("Running multiple workers without REDIS_URL: redelivered events routed to another worker are not deduplicated")
+            worker_startup_seconds = time.perf_counter() - worker_started
+            logger.info("Worker %d ready in %.3fs (import %.3fs)", os.getpid(), worker_startup_seconds, import_seconds)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            deadline = time.monotonic() + shutdown_timeout
+            await dispatcher.drain(timeout=shutdown_timeout)
+            remaining = max(0.0, deadline - time.monotonic())
+            await asyncio.get_running_loop().run_in_executor(None, expense_spool.stop, remaining)
+            REGISTRY.write_snapshot()
+            stop_logging()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    """ASGI 入口"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http":
+        if scope["path"] == "/callback" and scope["method"] == "POST":
+            await callback(scope, receive, send)
+        elif scope["path"] == "/metrics" and scope["method"] == "GET":
+            await send_response(send, 200, REGISTRY.render().encode(), b"text/plain; version=0.0.4; charset=utf-8")
+        else:
+            await send_response(send, 404, b"Not Found")
+
+def command_name(text):
+    """指令的英文代號，作為計時指標的 command 標籤"""
+    if text.startswith("記帳"):
+        return "record_bulk" if "\n" in text else "record"
+    for prefix, name in (("新增類別", "add_category"), ("總額", "total"), ("月報個人", "report_personal"),
+                         ("月報總和", "report_all"), ("年報", "report_year"), ("匯出", "export"),
+                         ("刪除", "delete")):
+        if text.startswith(prefix):
+            return name
+    return "help"
 
-@handler.add(MessageEvent, message=TextMessageContent)
 def handle_message(event):
-    user_id = event.source.user_id
     text = event.message.text.strip()
-    logger.info(f"User {user_id} sent: {text}")
+    token = current_command.set(command_name(text))
+    user_token = current_user_id.set(event.source.user_id)
+    try:
+        with timed("handle"):
+            process_message(event, text)
+    finally:
+        current_user_id.reset(user_token)
+        current_command.reset(token)
+
+def process_message(event, text):
+    user_id = event.source.user_id
+    logger.info("User %s sent: %s", user_id, text)
 
-    reply_text = "🤖 請輸入：記帳、總額、月報個人、月報總和、刪除、新增類別 或 總額 YYYY-MM、月報個人 YYYY-MM、月報總和 YYYY-MM"
+    reply_text = "🤖 請輸入：記帳、總額、月報個人、月報總和、年報、匯出、刪除、新增類別 或 總額 YYYY-MM、月報個人 YYYY-MM、月報總和 YYYY-MM、年報 YYYY、匯出 YYYY-MM"
 
     try:
         if text == "記帳":
             user_categories = get_user_categories(user_id)
-            reply_text = f"請輸入格式：記帳 項目 金額 類別（類別需為：{', '.join(user_categories)}）"
-
-        elif text.startswith("記帳 "):
-            parts = text.split()
-            if len(parts) != 4:
-                raise ValueError("格式錯誤，請輸入：記帳 項目 金額 類別")
+            reply_text = f"請輸入格式：記帳 項目 金額 類別（類別需為：{', '.join(user_categories)}）\n一次記多筆：第一行輸入「記帳」，之後每行輸入「項目 金額 類別」"
 
-            _, item, amount_str, category = parts
-            if len(item) > 50:
-                raise ValueError("項目名稱過長（最多50字）")
-            
+        elif text.startswith("記帳") and "\n" in text:
+            # 多行記帳：一次取得類別、一次寫入緩衝區
             user_categories = get_user_categories(user_id)
-            if category not in user_categories:
-                raise ValueError(f"無效類別，請選擇：{', '.join(user_categories)} 或使用「新增類別」指令")
-            
-            try:
-                amount = float(amount_str)
-                if amount <= 0:
-                    raise ValueError("金額必須大於0")
-            except ValueError:
-                raise ValueError("金額必須是有效數字")
-
-            data_response = supabase.table("expenses").insert({
-                "user_id": user_id,
-                "description": item,
-                "amount": amount,
-                "category": category,
-                "expense_date": pendulum.now('UTC').to_iso8601_string()
-            }).execute()
-
-            if data_response.data:
-                reply_text = f"✅ 已記帳：{item} - {amount:.0f} 元 - {category}"
+            entries, errors = parse_bulk(text, user_categories)
+            if entries:
+                now = pendulum.now('UTC')
+                with timed("spool.append"):
+                    expense_spool.append([build_row(user_id, item, amount, category, now) for item, amount, category in entries])
+                lines = [f"✅ 已記帳 {len(entries)} 筆，共 {sum(amount for _, amount, _ in entries):.0f} 元"]
+                lines += [f"- {item} - {amount:.0f} 元 - {category}" for item, amount, category in entries]
             else:
-                logger.error(f"Supabase insert failed: {data_response}")
-                raise Exception("記帳失敗，資料庫未回傳資料")
+                lines = ["❌ 沒有記帳成功，請確認格式：項目 金額 類別"]
+            if errors:
+                lines.append(f"⚠️ {len(errors)} 行未記帳：")
+                lines += [f"- 第 {line_no} 行：{message}" for line_no, message in errors]
+            reply_text = paginate(lines)
+
+        elif text.startswith("記帳 "):
+            item, amount, category = parse_expense(text.split()[1:], get_user_categories(user_id))
+            with timed("spool.append"):
+                expense_spool.append([build_row(user_id, item, amount, category)])
+            reply_text = f"✅ 已記帳：{item} - {amount:.0f} 元 - {category}"
 
         elif text.startswith("新增類別 "):
             category = text.split(" ", 1)[1].strip()
@@ -134,20 +334,16 @@ def handle_message(event):
             else:
                 target_date = pendulum.now('UTC')
 
-            start_of_month = target_date.start_of('month')
-            end_of_month = target_date.end_of('month')
-
-            data_response = supabase.table("expenses").select("amount").eq("user_id", user_id).gte(
-                "expense_date", start_of_month.to_iso8601_string()
-            ).lte("expense_date", end_of_month.to_iso8601_string()).execute()
-
-            if data_response.data:
-                total = sum(entry["amount"] for entry in data_response.data)
-                count = len(data_response.data)
-                month_str = target_date.format("YYYY-MM")
+            # 由彙總表直接取得，不必重新加總每筆記帳
+            month_str = target_date.format("YYYY-MM")
+            total, count = fetch_month_total(get_supabase(), user_id, month_str)
+            pending_total, pending_count = expense_spool.pending_total(user_id, month_str)
+            total += pending_total
+            count += pending_count
+            if count:
                 reply_text = f"💰 {month_str} 總支出：{total:.0f} 元，共 {count} 筆 (個人)"
             else:
-                reply_text = f"💰 {target_date.format('YYYY-MM')} 無支出記錄"
+                reply_text = f"💰 {month_str} 無支出記錄"
 
         elif text.startswith("月報個人") or text.startswith("月報總和"):
             is_personal = text.startswith("月報個人")
@@ -160,68 +356,75 @@ def handle_message(event):
             else:
                 target_date = pendulum.now('UTC')
 
-            start_of_month = target_date.start_of('month')
-            end_of_month = target_date.end_of('month')
+            # 類別統計由資料庫彙總，明細分頁讀取，並切成多則訊息回覆
+            report_user_id = user_id if is_personal else None
+            pending = expense_spool.pending_rows(target_date.format("YYYY-MM"), report_user_id)
+            with timed("report_render"):
+                report_lines = render_month_report(get_supabase(), target_date, report_user_id, pending)
+                reply_text = paginate(report_lines)
 
-            query = supabase.table("expenses").select("*").gte(
-                "expense_date", start_of_month.to_iso8601_string()
-            ).lte("expense_date", end_of_month.to_iso8601_string())
-            if is_personal:
-                query = query.eq("user_id", user_id)
+        elif text.startswith("年報"):
+            parts = text.split()
+            if len(parts) > 1:
+                if not (len(parts[1]) == 4 and parts[1].isdigit()):
+                    raise ValueError("年份格式錯誤，請輸入 YYYY")
+                year = int(parts[1])
+            else:
+                year = pendulum.now('UTC').year
 
-            data_response = query.execute()
+            # 整年的月份統計由彙總表一次取得
+            pending = expense_spool.pending_rows_between(f"{year}-01", f"{year}-12", user_id)
+            with timed("report_render"):
+                reply_text = paginate(render_year_report(get_supabase(), year, user_id, pending))
 
-            if not data_response.data:
-                reply_text = f"💰 {target_date.format('YYYY-MM')} 無支出記錄 ({'個人' if is_personal else '全用戶'})"
+        elif text.startswith("匯出"):
+            parts = text.split()
+            if len(parts) > 1:
+                try:
+                    target_date = pendulum.parse(parts[1], strict=False)
+                except ValueError:
+                    raise ValueError("月份格式錯誤，請輸入 YYYY-MM")
             else:
-                total = sum(entry["amount"] for entry in data_response.data)
-                count = len(data_response.data)
-                category_stats = {}
-                for entry in data_response.data:
-                    cat = entry["category"]
-                    if cat not in category_stats:
-                        category_stats[cat] = {"total": 0, "count": 0, "items": []}
-                    category_stats[cat]["total"] += entry["amount"]
-                    category_stats[cat]["count"] += 1
-                    category_stats[cat]["items"].append((entry["description"], entry["amount"]))
-
-                month_str = target_date.format("YYYY-MM")
-                report = f"💰 {month_str} {'個人' if is_personal else '全用戶'}月度報表 💰\n------------------------\n- 總支出：{total:.0f} 元\n- 總筆數：{count} 筆\n\n📊 按類別統計：\n"
-                for cat, stats in category_stats.items():
-                    report += f"- {cat}: {stats['total']:.0f} 元 ({stats['count']} 筆)\n"
-                    for desc, amt in stats["items"]:
-                        report += f"  - {desc}: {amt:.0f} 元\n"
-                report += f"\n⏰ 報表生成時間：{pendulum.now('UTC').format('YYYY-MM-DD HH:mm')} UTC"
-                reply_text = report
+                target_date = pendulum.now('UTC')
+
+            # 明細以 keyset 分頁邊讀邊切成訊息，超過回覆上限時停止查詢
+            pending = expense_spool.pending_rows(target_date.format("YYYY-MM"), user_id)
+            with timed("report_render"):
+                reply_text = paginate(render_export(get_supabase(), target_date, user_id, pending))
 
         elif text.startswith("刪除 "):
             item_to_delete = text.split(" ", 1)[1].strip()
-            data_response = supabase.table("expenses").select("id, description, amount, category").eq("user_id", user_id).eq("description", item_to_delete).order("expense_date", desc=True).limit(1).execute()
-
-            if data_response.data:
-                delete_response = supabase.table("expenses").delete().eq("id", data_response.data[0]["id"]).execute()
-                if delete_response.data or not delete_response.error:
-                    reply_text = f"🗑️ 已刪除：{item_to_delete} ({data_response.data[0]['amount']:.0f} 元, {data_response.data[0]['category']})"
-                else:
-                    raise Exception("刪除失敗，資料庫錯誤")
+            # 尚未寫入資料庫的記帳直接從緩衝區移除
+            discarded = expense_spool.discard_latest(user_id, item_to_delete)
+            if discarded:
+                reply_text = f"🗑️ 已刪除：{item_to_delete} ({discarded['amount']:.0f} 元, {discarded['category']})"
             else:
-                reply_text = f"⚠️ 找不到「{item_to_delete}」的記帳紀錄"
+                # 單一往返：資料庫端找出最新一筆並刪除，回傳被刪除的資料
+                with timed("supabase.delete_latest_expense"):
+                    data_response = get_supabase().rpc("delete_latest_expense", {
+                        "p_user_id": user_id,
+                        "p_description": item_to_delete,
+                    }).execute()
+
+                if data_response.data:
+                    deleted = data_response.data[0]
+                    reply_text = f"🗑️ 已刪除：{item_to_delete} ({float(deleted['amount']):.0f} 元, {deleted['category']})"
+                else:
+                    reply_text = f"⚠️ 找不到「{item_to_delete}」的記帳紀錄"
 
     except Exception as e:
-        logger.error(f"Error processing message: {str(e)}")
+        logger.error("Error processing message: %s", e)
         reply_text = f"❌ 操作失敗：{str(e)}"
 
     try:
-        logger.info(f"Replying to user {user_id}: {reply_text}")
-        messaging_api.reply_message(
-            reply_message_request={
-                "replyToken": event.reply_token,
-                "messages": [TextMessage(text=reply_text)]
-            }
-        )
+        logger.debug("Replying to user %s: %s", user_id, reply_text)
+        reply_texts = reply_text if isinstance(reply_text, list) else [reply_text]
+        with timed("reply_message"):
+            reply_message(event.reply_token, [TextMessage(text=t) for t in reply_texts])
     except Exception as e:
-        logger.error(f"Failed to send reply: {str(e)}")
+        logger.error("Failed to send reply: %s", e)
 
 if __name__ == "__main__":
+    import uvicorn
     port = int(os.getenv("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,266 @@
+"""本機模擬的 PostgREST（Supabase）與 LINE Messaging API 伺服器，可設定回應延遲
+
+只實作機器人實際用到的查詢：eq/gt/gte/lt/lte 篩選、select、order、limit、
+insert/upsert（含 on_conflict 去重）、delete，以及 month_category_totals、delete_latest_expense RPC；
+expenses 的寫入會同步更新 expense_rollups，模擬資料庫觸發器。
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+_NUMERIC_COLUMNS = {"id", "amount", "total", "count"}
+
+
+def _coerce(column, value):
+    if column in _NUMERIC_COLUMNS:
+        return float(value)
+    if column == "expense_date":
+        # ISO 8601 字串比較到秒即可
+        return value[:19]
+    return value
+
+
+def _match(row, filters):
+    for column, op, value in filters:
+        left = row.get(column)
+        if left is None:
+            return False
+        left, right = _coerce(column, left), _coerce(column, value)
+        if op == "eq" and not left == right:
+            return False
+        if op == "gt" and not left > right:
+            return False
+        if op == "gte" and not left >= right:
+            return False
+        if op == "lt" and not left < right:
+            return False
+        if op == "lte" and not left <= right:
+            return False
+    return True
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.tables = {"expenses": [], "categories": [], "expense_rollups": {}}
+        self._next_id = 1
+        self._idempotency_keys = set()
+        self.lock = threading.Lock()
+
+    def insert_expense(self, row):
+        """呼叫端需持有 lock；idempotency_key 重複時略過並回傳 None"""
+        key = row.get("idempotency_key")
+        if key is not None:
+            if key in self._idempotency_keys:
+                return None
+            self._idempotency_keys.add(key)
+        row = dict(row, id=self._next_id)
+        self._next_id += 1
+        self.tables["expenses"].append(row)
+        self._bump_rollup(row, 1)
+        return row
+
+    def delete_expense(self, row):
+        self.tables["expenses"].remove(row)
+        self._bump_rollup(row, -1)
+
+    def _bump_rollup(self, row, sign):
+        key = (row["user_id"], row["expense_date"][:7], row["category"])
+        rollup = self.tables["expense_rollups"].setdefault(
+            key, {"user_id": key[0], "month": key[1], "category": key[2], "total": 0.0, "count": 0}
+        )
+        rollup["total"] += sign * float(row["amount"])
+        rollup["count"] += sign
+        if rollup["count"] <= 0:
+            del self.tables["expense_rollups"][key]
+
+    def rows(self, table):
+        rows = self.tables[table]
+        return list(rows.values()) if isinstance(rows, dict) else rows
+
+    def seed(self, user_ids, count, month, categories=("三餐", "飲料", "加油")):
+        """預先放入 count 筆記帳，平均分配給 user_ids"""
+        with self.lock:
+            for index in range(count):
+                self.insert_expense({
+                    "user_id": user_ids[index % len(user_ids)],
+                    "description": f"seed-{index}",
+                    "amount": float(10 + index % 90),
+                    "category": categories[index % len(categories)],
+                    "expense_date": f"{month}-{1 + index % 28:02d}T12:00:00+00:00",
+                })
+
+    def rpc(self, name, params):
+        if name == "month_category_totals":
+            totals = {}
+            for rollup in self.tables["expense_rollups"].values():
+                if rollup["month"] != params.get("p_month"):
+                    continue
+                if params.get("p_user_id") is not None and rollup["user_id"] != params["p_user_id"]:
+                    continue
+                item = totals.setdefault(rollup["category"], {"category": rollup["category"], "total": 0.0, "count": 0})
+                item["total"] += rollup["total"]
+                item["count"] += rollup["count"]
+            return sorted(totals.values(), key=lambda item: -item["total"])
+        if name == "delete_latest_expense":
+            rows = [
+                row for row in self.tables["expenses"]
+                if row["user_id"] == params["p_user_id"] and row["description"] == params["p_description"]
+            ]
+            if not rows:
+                return []
+            row = max(rows, key=lambda row: (row["expense_date"][:19], row["id"]))
+            self.delete_expense(row)
+            return [{column: row[column] for column in ("id", "description", "amount", "category")}]
+        raise KeyError(name)
+
+
+class _LatencyMixin:
+    latency = 0.0
+    jitter = 0.0
+
+    def _sleep(self):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        # 一律讀完 body，否則 keep-alive 連線上的下一個請求會錯位
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PostgrestHandler(_LatencyMixin, BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    db = None
+
+    def _parse(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")  # rest / v1 / <table> 或 rest / v1 / rpc / <name>
+        params = parse_qsl(url.query, keep_blank_values=True)
+        filters, options = [], {}
+        for key, value in params:
+            if key in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                options[key] = value
+            else:
+                op, _, operand = value.partition(".")
+                filters.append((key, op, operand))
+        return parts[2:], filters, options
+
+    def _select(self, rows, filters, options):
+        rows = [row for row in rows if _match(row, filters)]
+        for clause in reversed(options.get("order", "").split(",") if options.get("order") else []):
+            column, _, direction = clause.partition(".")
+            rows.sort(key=lambda row: _coerce(column, row[column]), reverse=direction.startswith("desc"))
+        offset = int(options.get("offset", 0))
+        if "limit" in options:
+            rows = rows[offset:offset + int(options["limit"])]
+        columns = [column.strip() for column in options.get("select", "*").split(",")]
+        if columns != ["*"]:
+            rows = [{column: row.get(column) for column in columns} for row in rows]
+        return [dict(row) for row in rows]
+
+    def do_GET(self):
+        self._sleep()
+        self._read_json()
+        path, filters, options = self._parse()
+        with self.db.lock:
+            rows = self._select(self.db.rows(path[0]), filters, options)
+        self._send_json(200, rows)
+
+    def do_POST(self):
+        self._sleep()
+        path, filters, options = self._parse()
+        payload = self._read_json()
+        with self.db.lock:
+            if path[0] == "rpc":
+                status, result = 200, self.db.rpc(path[1], payload)
+            else:
+                rows = payload if isinstance(payload, list) else [payload]
+                if path[0] == "expenses":
+                    result = [row for row in map(self.db.insert_expense, rows) if row is not None]
+                else:
+                    result = [dict(row) for row in rows]
+                    self.db.tables[path[0]].extend(result)
+                status = 201
+        self._send_json(status, result)
+
+    def do_DELETE(self):
+        self._sleep()
+        self._read_json()
+        path, filters, options = self._parse()
+        with self.db.lock:
+            rows = [row for row in self.db.rows(path[0]) if _match(row, filters)]
+            for row in rows:
+                if path[0] == "expenses":
+                    self.db.delete_expense(row)
+                else:
+                    self.db.tables[path[0]].remove(row)
+        self._send_json(200, rows)
+
+
+class LineReplyHandler(_LatencyMixin, BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    recorder = None
+
+    def do_POST(self):
+        self._sleep()
+        payload = self._read_json()
+        if self.path.startswith("/v2/bot/message/reply"):
+            self.recorder.record(payload["replyToken"], [message.get("text", "") for message in payload["messages"]])
+        self._send_json(200, {"sentMessages": [
+            {"id": uuid.uuid4().hex, "quoteToken": uuid.uuid4().hex} for _ in payload["messages"]
+        ]})
+
+
+class ReplyRecorder:
+    """記錄每個 replyToken 收到回覆的時間，供壓測程式計算端到端延遲"""
+
+    def __init__(self):
+        self._replies = {}
+        self._cond = threading.Condition()
+
+    def record(self, reply_token, texts):
+        with self._cond:
+            self._replies[reply_token] = (time.perf_counter(), texts)
+            self._cond.notify_all()
+
+    def wait(self, reply_token, timeout):
+        deadline = time.perf_counter() + timeout
+        with self._cond:
+            while reply_token not in self._replies:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self._replies.pop(reply_token)
+
+
+def _serve(handler_class, port, **attrs):
+    handler = type(handler_class.__name__, (handler_class,), attrs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=handler_class.__name__, daemon=True).start()
+    return server
+
+
+def start_postgrest(db, port=0, latency=0.0, jitter=0.0):
+    return _serve(PostgrestHandler, port, db=db, latency=latency, jitter=jitter)
+
+
+def start_line(recorder, port=0, latency=0.0, jitter=0.0):
+    return _serve(LineReplyHandler, port, recorder=recorder, latency=latency, jitter=jitter)
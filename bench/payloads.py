@@ -0,0 +1,95 @@
+"""產生帶有正確 X-Line-Signature 的 webhook 請求，涵蓋機器人的各個指令"""
+import base64
+import hashlib
+import hmac
+import json
+import random
+import time
+import uuid
+
+# (指令代號, 權重)：代號與 app.command_name() 一致
+COMMAND_MIX = (
+    ("record", 40),
+    ("record_bulk", 5),
+    ("total", 25),
+    ("report_personal", 10),
+    ("report_all", 5),
+    ("report_year", 3),
+    ("export", 2),
+    ("delete", 10),
+    ("add_category", 5),
+)
+
+CATEGORIES = ("三餐", "飲料", "加油", "生活用品")
+
+
+def sign(body, channel_secret):
+    digest = hmac.new(channel_secret.encode(), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def message_event(user_id, text, reply_token, event_id=None, redelivery=False):
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "webhookEventId": event_id or uuid.uuid4().hex.upper(),
+        "deliveryContext": {"isRedelivery": redelivery},
+        "replyToken": reply_token,
+        "source": {"type": "user", "userId": user_id},
+        "message": {"id": uuid.uuid4().hex, "type": "text", "quoteToken": uuid.uuid4().hex, "text": text},
+    }
+
+
+def webhook_request(channel_secret, events, destination="Ubench"):
+    """回傳 (body, headers)"""
+    body = json.dumps({"destination": destination, "events": events}, ensure_ascii=False).encode()
+    headers = {"Content-Type": "application/json", "X-Line-Signature": sign(body, channel_secret)}
+    return body, headers
+
+
+class CommandGenerator:
+    """依 COMMAND_MIX 權重隨機產生指令文字；刪除只針對該用戶先前記過的項目"""
+
+    def __init__(self, seed=None, mix=COMMAND_MIX, month=None):
+        self._random = random.Random(seed)
+        self._commands = [name for name, _ in mix]
+        self._weights = [weight for _, weight in mix]
+        self._month = month
+        self._recorded = {}
+        self._counter = 0
+
+    def _item(self):
+        self._counter += 1
+        return f"item{self._counter}"
+
+    def _record_line(self, user_id):
+        item = self._item()
+        self._recorded.setdefault(user_id, []).append(item)
+        return f"{item} {self._random.randint(10, 500)} {self._random.choice(CATEGORIES)}"
+
+    def next(self, user_id):
+        """回傳 (指令代號, 訊息文字)"""
+        command = self._random.choices(self._commands, self._weights)[0]
+        month = f" {self._month}" if self._month else ""
+        if command == "delete" and not self._recorded.get(user_id):
+            command = "record"
+        if command == "record":
+            return command, f"記帳 {self._record_line(user_id)}"
+        if command == "record_bulk":
+            lines = [self._record_line(user_id) for _ in range(self._random.randint(2, 10))]
+            return command, "記帳\n" + "\n".join(lines)
+        if command == "total":
+            return command, f"總額{month}"
+        if command == "report_personal":
+            return command, f"月報個人{month}"
+        if command == "report_all":
+            return command, f"月報總和{month}"
+        if command == "report_year":
+            return command, f"年報 {self._month[:4]}" if self._month else "年報"
+        if command == "export":
+            return command, f"匯出{month}"
+        if command == "delete":
+            items = self._recorded[user_id]
+            return command, f"刪除 {items.pop(self._random.randrange(len(items)))}"
+        return command, f"新增類別 類別{self._random.randint(1, 20)}"
@@ -0,0 +1,266 @@
+"""離線壓測：以本機模擬的 Supabase 與 LINE 伺服器啟動機器人，量測各指令的吞吐量與延遲
+
+    python -m bench.run --concurrency 1,8,32 --data-sizes 0,10000 --requests 300
+
+延遲為端到端時間：從送出 webhook 到模擬 LINE 伺服器收到該 replyToken 的回覆。
+--max-p99-ms 可讓任一指令 p99 超過門檻（或有失敗請求）時以非零狀態結束，供 CI 使用。
+--redelivery-rate 會以該比例重送已回覆的事件（同一 webhookEventId），並確認機器人全部略過。
+"""
+import argparse
+import http.client
+import json
+import math
+import random
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from bench.fakes import FakeDatabase, ReplyRecorder, start_line, start_postgrest
+from bench.payloads import CommandGenerator, message_event, webhook_request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHANNEL_SECRET = "bench-channel-secret"
+# 格式正確的假 JWT，僅供 supabase client 初始化
+SUPABASE_KEY = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJyb2xlIjoiYW5vbiJ9.YmVuY2g"
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    # nearest-rank
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app(postgrest_port, line_port, spool_path, extra_env=None):
+    port = free_port()
+    env = dict(
+        os.environ,
+        LINE_CHANNEL_ACCESS_TOKEN="bench-token",
+        LINE_CHANNEL_SECRET=CHANNEL_SECRET,
+        SUPABASE_URL=f"http://127.0.0.1:{postgrest_port}",
+        SUPABASE_KEY=SUPABASE_KEY,
+        LINE_API_HOST=f"http://127.0.0.1:{line_port}",
+        EXPENSE_SPOOL_PATH=spool_path,
+        LOG_LEVEL="WARNING",
+        **(extra_env or {}),
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app exited with status {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/metrics")
+            if conn.getresponse().status == 200:
+                return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("app did not start within 30s")
+
+
+def fetch_metric(app_port, name):
+    """讀取 /metrics 中某個指標所有序列的總和"""
+    conn = http.client.HTTPConnection("127.0.0.1", app_port, timeout=10)
+    conn.request("GET", "/metrics")
+    text = conn.getresponse().read().decode()
+    return sum(float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(name))
+
+
+def run_level(app_port, recorder, concurrency, requests, seed, reply_timeout, redelivery_rate=0.0):
+    """以 concurrency 個用戶各自依序送出請求（等到回覆後才送下一個），共 requests 次"""
+    samples = []
+    errors = []
+    redelivered = [0]
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def worker(index):
+        user_id = f"Ubench{index:04d}"
+        generator = CommandGenerator(seed=seed + index)
+        chooser = random.Random(seed + index)
+        conn = http.client.HTTPConnection("127.0.0.1", app_port, timeout=reply_timeout)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            command, text = generator.next(user_id)
+            reply_token = uuid.uuid4().hex
+            event_id = uuid.uuid4().hex.upper()
+            body, headers = webhook_request(CHANNEL_SECRET, [message_event(user_id, text, reply_token, event_id)])
+            start = time.perf_counter()
+            try:
+                conn.request("POST", "/callback", body, headers)
+                response = conn.getresponse()
+                response.read()
+            except OSError as e:
+                errors.append((command, f"request failed: {e}"))
+                conn = http.client.HTTPConnection("127.0.0.1", app_port, timeout=reply_timeout)
+                continue
+            ack = time.perf_counter() - start
+            if response.status != 200:
+                errors.append((command, f"HTTP {response.status}"))
+                continue
+            reply = recorder.wait(reply_token, reply_timeout)
+            if reply is None:
+                errors.append((command, "no reply"))
+                continue
+            replied_at, texts = reply
+            if texts and texts[0].startswith("❌"):
+                errors.append((command, texts[0]))
+            with lock:
+                samples.append((command, replied_at - start, ack))
+            if chooser.random() < redelivery_rate:
+                # 模擬 LINE 逾時重送：同一事件再送一次，機器人應直接略過
+                body, headers = webhook_request(
+                    CHANNEL_SECRET, [message_event(user_id, text, reply_token, event_id, redelivery=True)]
+                )
+                try:
+                    conn.request("POST", "/callback", body, headers)
+                    conn.getresponse().read()
+                    with lock:
+                        redelivered[0] += 1
+                except OSError as e:
+                    errors.append((command, f"redelivery failed: {e}"))
+                    conn = http.client.HTTPConnection("127.0.0.1", app_port, timeout=reply_timeout)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    commands = {}
+    for command, latency, ack in samples:
+        commands.setdefault(command, []).append(latency)
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "completed": len(samples),
+        "errors": len(errors),
+        "redelivered": redelivered[0],
+        "error_samples": [f"{command}: {message}" for command, message in errors[:5]],
+        "rps": len(samples) / elapsed if elapsed else 0.0,
+        "ack_p50_ms": _ms(percentile([ack for _, _, ack in samples], 50)),
+        "ack_p99_ms": _ms(percentile([ack for _, _, ack in samples], 99)),
+        "commands": {
+            command: {
+                "count": len(latencies),
+                "p50_ms": _ms(percentile(latencies, 50)),
+                "p99_ms": _ms(percentile(latencies, 99)),
+            }
+            for command, latencies in sorted(commands.items())
+        },
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def print_result(result):
+    print(
+        f"\n== data_size={result['data_size']} concurrency={result['concurrency']} "
+        f"rps={result['rps']:.1f} completed={result['completed']}/{result['requests']} errors={result['errors']} "
+        f"ack p50/p99={result['ack_p50_ms']}/{result['ack_p99_ms']} ms "
+        f"redelivered/deduplicated={result['redelivered']}/{result['deduplicated']}"
+    )
+    print(f"{'command':<18}{'count':>8}{'p50 ms':>12}{'p99 ms':>12}")
+    for command, stats in result["commands"].items():
+        print(f"{command:<18}{stats['count']:>8}{stats['p50_ms']:>12}{stats['p99_ms']:>12}")
+    for sample in result["error_samples"]:
+        print(f"  ! {sample}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,8,32", help="逗號分隔的並行用戶數")
+    parser.add_argument("--data-sizes", default="0,10000", help="逗號分隔的預先寫入記帳筆數")
+    parser.add_argument("--requests", type=int, default=300, help="每個並行層級送出的請求數")
+    parser.add_argument("--db-latency-ms", type=float, default=20, help="模擬 Supabase 每次請求的延遲")
+    parser.add_argument("--line-latency-ms", type=float, default=30, help="模擬 LINE reply API 的延遲")
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--reply-timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--redelivery-rate", type=float, default=0.0, help="已回覆事件的重送比例（0~1）")
+    parser.add_argument("--json", help="結果另存為 JSON 檔")
+    parser.add_argument("--max-p99-ms", type=float, help="任一指令 p99 超過此值或有失敗請求時以狀態 1 結束")
+    args = parser.parse_args(argv)
+
+    concurrency_levels = [int(value) for value in args.concurrency.split(",")]
+    data_sizes = [int(value) for value in args.data_sizes.split(",")]
+    month = time.strftime("%Y-%m", time.gmtime())
+    results = []
+
+    for data_size in data_sizes:
+        db = FakeDatabase()
+        db.seed([f"Ubench{index:04d}" for index in range(max(concurrency_levels))], data_size, month)
+        recorder = ReplyRecorder()
+        postgrest = start_postgrest(db, latency=args.db_latency_ms / 1000, jitter=args.jitter_ms / 1000)
+        line = start_line(recorder, latency=args.line_latency_ms / 1000, jitter=args.jitter_ms / 1000)
+        with tempfile.TemporaryDirectory() as tmp:
+            process, app_port = start_app(postgrest.server_port, line.server_port, os.path.join(tmp, "spool.db"))
+            try:
+                for concurrency in concurrency_levels:
+                    deduplicated = fetch_metric(app_port, "line_bot_webhook_events_deduplicated_total")
+                    result = run_level(
+                        app_port, recorder, concurrency, args.requests, args.seed, args.reply_timeout, args.redelivery_rate
+                    )
+                    result["data_size"] = data_size
+                    result["deduplicated"] = int(fetch_metric(app_port, "line_bot_webhook_events_deduplicated_total") - deduplicated)
+                    print_result(result)
+                    results.append(result)
+            finally:
+                process.terminate()
+                process.wait(30)
+                postgrest.shutdown()
+                line.shutdown()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.max_p99_ms is not None:
+        failed = [
+            f"data_size={result['data_size']} concurrency={result['concurrency']} {command} p99={stats['p99_ms']}ms"
+            for result in results
+            for command, stats in result["commands"].items()
+            if stats["p99_ms"] > args.max_p99_ms
+        ] + [
+            f"data_size={result['data_size']} concurrency={result['concurrency']} errors={result['errors']}"
+            for result in results
+            if result["errors"]
+        ] + [
+            f"data_size={result['data_size']} concurrency={result['concurrency']} "
+            f"redelivered={result['redelivered']} deduplicated={result['deduplicated']}"
+            for result in results
+            if result["redelivered"] != result["deduplicated"]
+        ]
+        for message in failed:
+            print(f"❌ {message}")
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
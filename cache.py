@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """執行緒安全的 LRU + TTL 快取，附命中／未命中計數"""
+
+    def __init__(self, maxsize=1024, ttl=300, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires_at = item
+                if expires_at > self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """讀取但不計入命中／未命中，也不更新 LRU 順序"""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING and item[1] > self._clock():
+                return item[0]
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires_at = self._clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def add(self, key, value=True, ttl=None):
+        """鍵不存在（或已過期）時才寫入，回傳是否寫入"""
+        now = self._clock()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING and item[1] > now:
+                return False
+            self._data[key] = (value, now + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return None if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class LocalInvalidationBackend:
+    """單一程序內的失效通知（預設），僅通知同一 worker 的訂閱者"""
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def publish(self, key):
+        for callback in self._subscribers:
+            callback(key)
+
+
+class RedisInvalidationBackend:
+    """透過 Redis pub/sub 在多個 gunicorn worker 之間廣播失效通知"""
+
+    def __init__(self, url, channel="line-budget-bot:invalidate"):
+        import redis  # 僅在設定 REDIS_URL 時匯入
+
+        self._redis = redis.Redis.from_url(url)
+        self._channel = channel
+        self._subscribers = []
+        self._thread = None
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+        if self._thread is None:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self._channel: self._on_message})
+            self._thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def _on_message(self, message):
+        key = message["data"].decode()
+        for callback in self._subscribers:
+            callback(key)
+
+    def publish(self, key):
+        try:
+            self._redis.publish(self._channel, key)
+        except Exception as e:
+            # 廣播失敗時其他 worker 的快取最多延遲 TTL 秒才更新
+            logger.error("Failed to publish invalidation: %s", e)
+
+
+def create_invalidation_backend(redis_url=None):
+    if redis_url:
+        return RedisInvalidationBackend(redis_url)
+    return LocalInvalidationBackend()
+
+
+class LocalEventIdStore:
+    """單一程序內已處理的 webhookEventId（預設），數量與保存時間皆有上限
+
+    只在同一個 worker 內有效；多個 worker 時重送的事件可能落在其他 worker，需設定 REDIS_URL
+    """
+
+    shared = False
+
+    def __init__(self, maxsize=50000, ttl=86400):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def claim(self, event_ids):
+        """逐一認領事件，回傳對應的布林值；False 表示先前已認領過"""
+        return [self._cache.add(event_id) for event_id in event_ids]
+
+    async def release(self, event_ids):
+        for event_id in event_ids:
+            self._cache.pop(event_id)
+
+
+class RedisEventIdStore:
+    """以 Redis SET NX EX 在多個 gunicorn worker 之間共用已處理的 webhookEventId
+
+    使用 redis.asyncio，認領時不會阻塞 worker 的事件迴圈
+    """
+
+    shared = True
+
+    def __init__(self, url, ttl=86400, prefix="line-budget-bot:event:"):
+        import redis.asyncio  # 僅在設定 REDIS_URL 時匯入
+
+        self._from_url = redis.asyncio.Redis.from_url
+        self._url = url
+        self._ttl = int(ttl)
+        self._prefix = prefix
+        self._redis = None
+        self._pid = None
+
+    def _client(self):
+        # 連線綁定在 worker 的事件迴圈上，fork 之後才建立
+        if self._redis is None or self._pid != os.getpid():
+            self._redis = self._from_url(self._url)
+            self._pid = os.getpid()
+        return self._redis
+
+    async def claim(self, event_ids):
+        # 同一個 webhook 的事件以 pipeline 一次往返認領
+        try:
+            pipe = self._client().pipeline(transaction=False)
+            for event_id in event_ids:
+                pipe.set(self._prefix + event_id, 1, nx=True, ex=self._ttl)
+            return [bool(result) for result in await pipe.execute()]
+        except Exception as e:
+            # Redis 無法使用時照常處理，寧可重複也不遺漏
+            logger.error("Failed to claim event ids: %s", e)
+            return [True] * len(event_ids)
+
+    async def release(self, event_ids):
+        if not event_ids:
+            return
+        try:
+            await self._client().delete(*(self._prefix + event_id for event_id in event_ids))
+        except Exception as e:
+            logger.error("Failed to release event ids: %s", e)
+
+
+def create_event_id_store(redis_url=None, maxsize=50000, ttl=86400):
+    if redis_url:
+        return RedisEventIdStore(redis_url, ttl)
+    return LocalEventIdStore(maxsize, ttl)
@@ -1,5 +1,7 @@
 import psycopg2
 
+from export import iter_expenses
+
 conn = psycopg2.connect(
     dbname="lineuser",
     user="lineuser_user",
@@ -10,17 +12,16 @@ conn = psycopg2.connect(
 )
 
 try:
-    cur = conn.cursor()
-    cur.execute("SELECT user_id, description, amount, category, expense_date FROM expenses")
-    records = cur.fetchall()
-    if records:
-        print("資料庫中的記錄：")
-        for record in records:
-            print(record)
-    else:
+    # 以伺服器端游標逐批讀取，不一次載入整張表
+    count = 0
+    for record in iter_expenses(conn):
+        if not count:
+            print("資料庫中的記錄：")
+        print(record)
+        count += 1
+    if not count:
         print("資料庫中沒有記錄！")
 except Exception as e:
     print(f"查詢失敗: {e}")
 finally:
-    cur.close()
-    conn.close()
\ No newline at end of file
+    conn.close()
@@ -0,0 +1,142 @@
+"""Supabase（PostgREST）與 LINE Messaging API 的連線
+
+兩者都在每個 worker 第一次使用時才建立，並在 fork 後重新建立，
+因此可搭配 gunicorn --preload：套件只在 master 載入一次，連線則由各 worker 自行持有。
+連線池大小、keep-alive 與逾時皆可由環境變數調整，並統計連線重用情形。
+"""
+import importlib.util
+import os
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+from linebot.v3.messaging import ApiClient, Configuration, MessagingApi
+from supabase import ClientOptions, create_client
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 16))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", 10))
+LINE_TIMEOUT = float(os.getenv("LINE_TIMEOUT", 10))
+# HTTP/2 需要 h2 套件；未安裝時使用 HTTP/1.1 keep-alive
+HTTP2 = os.getenv("HTTP2", "auto") != "off" and importlib.util.find_spec("h2") is not None
+
+
+class ConnectionStats:
+    """請求數與新建連線數；重用率 = 1 - connections / requests"""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def add(self, requests=0, connections=0):
+        with self._lock:
+            self.requests += requests
+            self.connections += connections
+
+    @property
+    def reuse_ratio(self):
+        return 1 - self.connections / self.requests if self.requests else 0.0
+
+
+supabase_stats = ConnectionStats()
+
+
+class _CountingTransport(httpx.HTTPTransport):
+    """透過 httpcore 的 trace 擴充計算實際建立的 TCP 連線數"""
+
+    def __init__(self, stats, **kwargs):
+        super().__init__(**kwargs)
+        self._stats = stats
+
+    def handle_request(self, request):
+        request.extensions["trace"] = self._trace
+        self._stats.add(requests=1)
+        return super().handle_request(request)
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self._stats.add(connections=1)
+
+
+def _create_supabase():
+    http_client = httpx.Client(
+        transport=_CountingTransport(
+            supabase_stats,
+            http2=HTTP2,
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_SIZE,
+                max_keepalive_connections=HTTP_POOL_SIZE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        ),
+        timeout=httpx.Timeout(SUPABASE_TIMEOUT),
+        follow_redirects=True,
+    )
+    return create_client(
+        os.getenv("SUPABASE_URL"),
+        os.getenv("SUPABASE_KEY"),
+        options=ClientOptions(httpx_client=http_client),
+    )
+
+
+def _create_messaging_api():
+    configuration = Configuration(access_token=os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
+    # urllib3 連線池：每個主機保留的 keep-alive 連線數需不少於同時回覆的執行緒數
+    configuration.connection_pool_maxsize = HTTP_POOL_SIZE
+    api = MessagingApi(ApiClient(configuration=configuration))
+    if os.getenv("LINE_API_HOST"):
+        # 壓測時指向本機模擬的 LINE 伺服器
+        api.line_base_path = os.getenv("LINE_API_HOST")
+    return api
+
+
+_lock = threading.Lock()
+_pid = None
+_supabase = None
+_messaging_api = None
+
+
+def _reset_after_fork():
+    global _pid, _supabase, _messaging_api
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _supabase = None
+        _messaging_api = None
+
+
+def get_supabase():
+    global _supabase
+    if _supabase is None or _pid != os.getpid():
+        with _lock:
+            _reset_after_fork()
+            if _supabase is None:
+                _supabase = _create_supabase()
+    return _supabase
+
+
+def get_messaging_api():
+    global _messaging_api
+    if _messaging_api is None or _pid != os.getpid():
+        with _lock:
+            _reset_after_fork()
+            if _messaging_api is None:
+                _messaging_api = _create_messaging_api()
+    return _messaging_api
+
+
+def reply_message(reply_token, messages):
+    get_messaging_api().reply_message(
+        reply_message_request={"replyToken": reply_token, "messages": messages},
+        _request_timeout=LINE_TIMEOUT,
+    )
+
+
+def line_pool_stats():
+    """LINE API 的 (請求數, 連線數)，直接讀取 urllib3 連線池的計數"""
+    if _messaging_api is None or _pid != os.getpid():
+        return 0, 0
+    base = urlsplit(_messaging_api.line_base_path)
+    pool_manager = _messaging_api.api_client.rest_client.pool_manager
+    pool = pool_manager.connection_from_host(base.hostname, base.port, base.scheme)
+    return pool.num_requests, pool.num_connections
@@ -1,4 +1,5 @@
 import psycopg2
+from migrations import migrate
 
 # 資料庫連線設定
 conn = psycopg2.connect(
@@ -10,25 +11,11 @@ conn = psycopg2.connect(
     sslmode="require"
 )
 
-# 建立資料表 expenses
-create_table_sql = """
-CREATE TABLE IF NOT EXISTS expenses (
-    id SERIAL PRIMARY KEY,
-    user_id TEXT NOT NULL,
-    amount NUMERIC NOT NULL,
-    category TEXT NOT NULL,
-    description TEXT NOT NULL,
-    expense_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-"""
-
+# 資料表、索引與函式皆由 migrations.py 依版本建立
 try:
-    cur = conn.cursor()
-    cur.execute(create_table_sql)
-    conn.commit()
-    cur.close()
-    print("✅ 資料表 expenses 已建立或已存在")
+    if not migrate(conn):
+        print("✅ 資料庫已是最新版本")
 except Exception as e:
     print(f"❌ 建立資料表時發生錯誤: {e}")
 finally:
-    conn.close()
\ No newline at end of file
+    conn.close()
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def ordering_key(event):
+    """同一來源（用戶／群組／聊天室）的事件使用相同的 key，以保證處理順序
+
+    群組與聊天室的事件也帶有發訊者的 user_id，需先以群組／聊天室為 key，同一群組內才會依序處理
+    """
+    source = getattr(event, "source", None)
+    for attr in ("group_id", "room_id", "user_id"):
+        value = getattr(source, attr, None)
+        if value:
+            return value
+    return ""
+
+
+class EventDispatcher:
+    """將 webhook 事件交給執行緒池處理
+
+    - 同一 ordering key 的事件依序處理，不同 key 之間可並行
+    - 順序只在單一 process 內成立：多個 gunicorn worker 時，同一用戶的連續訊息可能由不同 worker 同時處理
+    - 尚未處理完的事件數量超過 max_pending 時拒收（由呼叫端回應 503，讓 LINE 重送）
+    - drain() 會停止收件並等待已收下的事件處理完畢
+    """
+
+    def __init__(self, handle_event, max_workers=8, max_pending=256):
+        self._handle_event = handle_event
+        self._max_workers = max_workers
+        self._max_pending = max_pending
+        self._executor = None
+        self._queues = {}
+        self._tasks = set()
+        self._pending = 0
+        self._closed = False
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def try_submit(self, events):
+        """在事件迴圈中呼叫；全部收下時回傳 True，佇列已滿或已關閉時回傳 False"""
+        if self._closed or self._pending + len(events) > self._max_pending:
+            return False
+        if self._executor is None:
+            # 延遲建立，確保執行緒在 gunicorn fork 之後才產生
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="line-event")
+        loop = asyncio.get_running_loop()
+        for event in events:
+            key = ordering_key(event)
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = []
+                task = loop.create_task(self._run(key, queue))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            queue.append(event)
+            self._pending += 1
+        return True
+
+    async def _run(self, key, queue):
+        loop = asyncio.get_running_loop()
+        try:
+            while queue:
+                event = queue.pop(0)
+                try:
+                    await loop.run_in_executor(self._executor, self._handle_event, event)
+                except Exception:
+                    logger.exception("Event handler failed")
+                finally:
+                    self._pending -= 1
+        finally:
+            del self._queues[key]
+
+    async def drain(self, timeout=None):
+        """停止收件並等待剩餘事件處理完畢"""
+        self._closed = True
+        if self._tasks:
+            logger.info("Draining %d pending events", self._pending)
+            done, not_done = await asyncio.wait(set(self._tasks), timeout=timeout)
+            if not_done:
+                logger.warning("Drain timed out with %d events unprocessed", self._pending)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
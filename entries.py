@@ -0,0 +1,60 @@
+import pendulum
+
+MAX_ITEM_LENGTH = 50
+MAX_BULK_LINES = 50
+
+
+def parse_expense(tokens, user_categories):
+    """驗證「項目 金額 類別」三個欄位，回傳 (項目, 金額, 類別)，格式錯誤時拋出 ValueError"""
+    if len(tokens) != 3:
+        raise ValueError("格式錯誤，請輸入：記帳 項目 金額 類別")
+
+    item, amount_str, category = tokens
+    if len(item) > MAX_ITEM_LENGTH:
+        raise ValueError(f"項目名稱過長（最多{MAX_ITEM_LENGTH}字）")
+
+    if category not in user_categories:
+        raise ValueError(f"無效類別，請選擇：{', '.join(user_categories)} 或使用「新增類別」指令")
+
+    try:
+        amount = float(amount_str)
+    except ValueError:
+        raise ValueError("金額必須是有效數字")
+    if amount <= 0:
+        raise ValueError("金額必須大於0")
+    return item, amount, category
+
+
+def parse_bulk(text, user_categories):
+    """解析多行記帳，每行為「項目 金額 類別」（可加上「記帳」前綴）
+
+    回傳 (有效記帳列表, 錯誤列表)，錯誤為 (行號, 錯誤訊息)
+    """
+    lines = text.splitlines()
+    if lines and lines[0].strip() == "記帳":
+        lines = lines[1:]
+    if len(lines) > MAX_BULK_LINES:
+        raise ValueError(f"一次最多記帳 {MAX_BULK_LINES} 筆")
+
+    entries, errors = [], []
+    for line_no, line in enumerate(lines, start=1):
+        tokens = line.split()
+        if not tokens:
+            continue
+        if tokens[0] == "記帳":
+            tokens = tokens[1:]
+        try:
+            entries.append(parse_expense(tokens, user_categories))
+        except ValueError as e:
+            errors.append((line_no, str(e)))
+    return entries, errors
+
+
+def build_row(user_id, item, amount, category, expense_date=None):
+    return {
+        "user_id": user_id,
+        "description": item,
+        "amount": amount,
+        "category": category,
+        "expense_date": (expense_date or pendulum.now('UTC')).to_iso8601_string()
+    }
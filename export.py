@@ -0,0 +1,113 @@
+"""串流匯出記帳資料與年度月份統計
+
+    python export.py csv [--user USER_ID] [--year 2025] [--output expenses.csv]
+    python export.py jsonl [--user USER_ID] [--year 2025] [--output expenses.jsonl]
+    python export.py summary [--user USER_ID] [--year 2025]
+
+連線字串取自環境變數 DATABASE_URL。以伺服器端游標（named cursor）每次取回 itersize 筆，
+邊讀邊寫，記憶體用量與資料量無關；summary 依日期順序讀過一次資料，每個月份結束時即輸出該月統計。
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+COLUMNS = ("id", "user_id", "description", "amount", "category", "expense_date")
+
+
+def iter_expenses(conn, user_id=None, year=None, itersize=2000):
+    """依 (expense_date, id) 順序逐筆產生記帳資料"""
+    conditions, params = [], []
+    if user_id is not None:
+        conditions.append("user_id = %s")
+        params.append(user_id)
+    if year is not None:
+        conditions.append("expense_date >= %s AND expense_date < %s")
+        params += [f"{year}-01-01", f"{year + 1}-01-01"]
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    with conn.cursor(name="export_expenses") as cur:
+        cur.itersize = itersize
+        cur.execute(f"SELECT {', '.join(COLUMNS)} FROM expenses{where} ORDER BY expense_date, id", params)
+        for values in cur:
+            row = dict(zip(COLUMNS, values))
+            row["amount"] = float(row["amount"])
+            row["expense_date"] = row["expense_date"].isoformat() if row["expense_date"] else None
+            yield row
+
+
+def write_csv(rows, out):
+    writer = csv.DictWriter(out, fieldnames=COLUMNS)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_jsonl(rows, out):
+    count = 0
+    for row in rows:
+        out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+def summarize_by_month(rows):
+    """rows 需依日期排序；每個月份讀完即產生 (月份, 總額, 筆數, {類別: 總額})"""
+    month, total, count, categories = None, 0.0, 0, {}
+    for row in rows:
+        row_month = (row["expense_date"] or "")[:7]
+        if row_month != month:
+            if count:
+                yield month, total, count, categories
+            month, total, count, categories = row_month, 0.0, 0, {}
+        total += row["amount"]
+        count += 1
+        categories[row["category"]] = categories.get(row["category"], 0.0) + row["amount"]
+    if count:
+        yield month, total, count, categories
+
+
+def print_summary(rows):
+    year_total, year_count = 0.0, 0
+    for month, total, count, categories in summarize_by_month(rows):
+        year_total += total
+        year_count += count
+        top = ", ".join(f"{category} {amount:.0f}" for category, amount in sorted(categories.items(), key=lambda item: -item[1]))
+        print(f"{month}  {total:>12.0f} 元  {count:>6} 筆  {top}")
+    print(f"合計  {year_total:>12.0f} 元  {year_count:>6} 筆")
+
+
+def main(argv=None):
+    import psycopg2
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("format", choices=("csv", "jsonl", "summary"))
+    parser.add_argument("--user", help="只匯出此用戶")
+    parser.add_argument("--year", type=int, help="只匯出此年度")
+    parser.add_argument("--output", help="輸出檔案，預設為標準輸出")
+    parser.add_argument("--itersize", type=int, default=2000, help="每次自資料庫取回的筆數")
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    try:
+        rows = iter_expenses(conn, args.user, args.year, args.itersize)
+        if args.format == "summary":
+            print_summary(rows)
+            return 0
+        out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+        try:
+            count = (write_csv if args.format == "csv" else write_jsonl)(rows, out)
+        finally:
+            if args.output:
+                out.close()
+        print(f"✅ 已匯出 {count} 筆", file=sys.stderr)
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
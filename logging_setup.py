@@ -0,0 +1,102 @@
+import contextvars
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+from metrics import current_command
+
+# 目前處理中訊息的發送者，與 current_command 一起附加到每筆紀錄
+current_user_id = contextvars.ContextVar("current_user_id", default=None)
+
+_listener = None
+
+
+def _logfmt_value(value):
+    text = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    if not text or any(char in text for char in ' ="\\'):
+        return f'"{text}"'
+    return text
+
+
+class KeyValueFormatter(logging.Formatter):
+    """輸出 key=value（logfmt）格式，一筆紀錄一行，方便日誌平台依欄位查詢
+
+    由 QueueHandler 在發出紀錄的執行緒格式化，因此讀得到該執行緒的 context variable
+    """
+
+    default_time_format = "%Y-%m-%dT%H:%M:%S"
+    default_msec_format = "%s.%03d"
+
+    def format(self, record):
+        fields = [
+            ("ts", self.formatTime(record)),
+            ("level", record.levelname),
+            ("logger", record.name),
+            ("command", current_command.get()),
+            ("user_id", current_user_id.get()),
+            ("msg", record.getMessage()),
+        ]
+        if record.exc_info:
+            fields.append(("exc", self.formatException(record.exc_info)))
+        return " ".join(f"{key}={_logfmt_value(value)}" for key, value in fields if value is not None)
+
+
+class TruncateFilter(logging.Filter):
+    """將訊息截斷至 max_length 字，避免整份 webhook 內容或月報寫入日誌"""
+
+    def __init__(self, max_length):
+        super().__init__()
+        self.max_length = max_length
+
+    def filter(self, record):
+        message = record.getMessage()
+        if len(message) > self.max_length:
+            record.msg = f"{message[:self.max_length]}…(+{len(message) - self.max_length} chars)"
+            record.args = None
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """INFO 以下的紀錄依 rate 抽樣，WARNING 以上一律保留"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+def setup_logging(level=logging.INFO, sample_rate=1.0, max_length=500):
+    """日誌先放入佇列，由背景執行緒輸出，處理請求的執行緒不會被 I/O 阻塞"""
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    # 先抽樣再截斷，被丟棄的紀錄不必格式化
+    queue_handler.addFilter(SampleFilter(sample_rate))
+    queue_handler.addFilter(TruncateFilter(max_length))
+    queue_handler.setFormatter(KeyValueFormatter())
+
+    # 紀錄放入佇列前已格式化完成，輸出端直接寫出
+    stream_handler = logging.StreamHandler(sys.stderr)
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    def start_listener():
+        global _listener
+        _listener = QueueListener(log_queue, stream_handler)
+        _listener.start()
+
+    start_listener()
+    # fork 後子程序不會繼承輸出執行緒，需重新啟動
+    os.register_at_fork(after_in_child=start_listener)
+
+
+def stop_logging():
+    """輸出佇列中剩餘的紀錄（關閉前呼叫）"""
+    if _listener is not None:
+        _listener.stop()
@@ -0,0 +1,257 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 目前處理中的指令，供各階段計時時作為 command 標籤
+current_command = contextvars.ContextVar("current_command", default="none")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _render_family(name, help, type, samples):
+    """samples 為 (名稱後綴, ((標籤, 值), ...), 數值)"""
+    yield f"# HELP {name} {help}"
+    yield f"# TYPE {name} {type}"
+    for suffix, labels, value in samples:
+        yield f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "", tuple(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # 各 bucket 計數（非累計）、總和、筆數
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items()]
+        for key, (counts, total, count) in items:
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield "_bucket", labels + (("le", repr(bound)),), cumulative
+            yield "_bucket", labels + (("le", "+Inf"),), count
+            yield "_sum", labels, float(total)
+            yield "_count", labels, count
+
+
+class CallbackMetric:
+    """輸出時才呼叫 fn 取得數值，用於快取命中數、佇列長度等既有計數"""
+
+    def __init__(self, name, help, fn, type="gauge"):
+        self.name = name
+        self.help = help
+        self.type = type
+        self._fn = fn
+
+    def samples(self):
+        yield "", (), self._fn()
+
+
+class Registry:
+    """指標登錄表
+
+    gunicorn 有多個 worker 時，每次抓取 /metrics 只會落在其中一個 worker。
+    enable_multiprocess() 後各 worker 定期把自己的數值寫入共用目錄，輸出時合併所有 worker：
+    counter 與 histogram 相加（已結束的 worker 仍計入，總數不會倒退），gauge 則加上 pid 標籤、只列出存活的 worker。
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._directory = None
+        self._interval = None
+        self._writer_pid = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, fn, type="gauge"):
+        return self.register(CallbackMetric(name, help, fn, type))
+
+    def collect(self):
+        """本程序的所有指標：[(名稱, 說明, 類型, samples), ...]"""
+        families = []
+        for metric in self._metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error("Failed to collect metric %s: %s", metric.name, e)
+                continue
+            families.append((metric.name, metric.help, metric.type, samples))
+        return families
+
+    def enable_multiprocess(self, directory, interval=5.0):
+        """各 worker 的數值寫入 directory 後合併輸出；directory 需在啟動前清空（或每次使用新目錄）"""
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._interval = interval
+
+    def start_writer(self):
+        """在 worker 內啟動定期寫入的背景執行緒（fork 之後呼叫）"""
+        if self._directory is None or self._writer_pid == os.getpid():
+            return
+        self._writer_pid = os.getpid()
+        threading.Thread(target=self._write_loop, name="metrics-writer", daemon=True).start()
+
+    def _write_loop(self):
+        while True:
+            self.write_snapshot()
+            time.sleep(self._interval)
+
+    def write_snapshot(self):
+        if self._directory is None:
+            return
+        path = os.path.join(self._directory, f"{os.getpid()}.json")
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.collect(), f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.error("Failed to write metrics snapshot: %s", e)
+
+    def _snapshots(self):
+        """產生 (pid, 是否存活, families)；本程序排在最前面並使用即時數值"""
+        yield os.getpid(), True, self.collect()
+        for filename in sorted(os.listdir(self._directory)):
+            pid, ext = os.path.splitext(filename)
+            if ext != ".json" or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                with open(os.path.join(self._directory, filename), encoding="utf-8") as f:
+                    families = json.load(f)
+            except (OSError, ValueError):
+                continue
+            yield int(pid), _alive(int(pid)), families
+
+    def render(self):
+        """Prometheus text exposition format"""
+        if self._directory is None:
+            families = self.collect()
+        else:
+            self.write_snapshot()
+            families = _merge(self._snapshots())
+        lines = []
+        for name, help, type, samples in families:
+            lines.extend(_render_family(name, help, type, samples))
+        return "\n".join(lines) + "\n"
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(snapshots):
+    merged = {}
+    for pid, alive, families in snapshots:
+        for name, help, type, samples in families:
+            family = merged.setdefault(name, (help, type, {}))
+            values = family[2]
+            for suffix, labels, value in samples:
+                labels = tuple(tuple(pair) for pair in labels)
+                if type == "gauge":
+                    if alive:
+                        values[(suffix, labels + (("pid", str(pid)),))] = value
+                else:
+                    values[(suffix, labels)] = values.get((suffix, labels), 0) + value
+    return [
+        (name, help, type, [(suffix, labels, value) for (suffix, labels), value in values.items()])
+        for name, (help, type, values) in merged.items()
+    ]
+
+
+REGISTRY = Registry()
+
+stage_seconds = REGISTRY.histogram(
+    "line_bot_stage_duration_seconds",
+    "Time spent in each processing stage",
+    ("stage", "command"),
+)
+
+
+@contextmanager
+def timed(stage, command=None):
+    """計時一個處理階段；未指定 command 時使用目前處理中的指令"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=stage, command=command or current_command.get())
@@ -0,0 +1,259 @@
+"""資料庫結構的版本化遷移
+
+    python migrations.py migrate  # 依序套用尚未執行的版本
+    python migrations.py status   # 列出各版本是否已套用
+    python migrations.py check    # 以 EXPLAIN 確認機器人的查詢都能使用索引
+
+連線字串取自環境變數 DATABASE_URL。每個版本在獨立交易中執行並記錄於 schema_migrations，
+所有語句皆可重複執行，已用舊版 create_table.py 建立的資料庫也能直接從版本 1 開始套用。
+已發布的版本內容不可再修改，結構變更一律新增版本。
+"""
+import os
+import sys
+
+MIGRATIONS = [
+    (1, "create expenses", """
+CREATE TABLE IF NOT EXISTS expenses (
+    id SERIAL PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    amount NUMERIC NOT NULL,
+    category TEXT NOT NULL,
+    description TEXT NOT NULL,
+    expense_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""),
+    # 背景批次寫入的去重鍵（由本地緩衝區產生），重送時以 ON CONFLICT 略過
+    (2, "expenses idempotency key", """
+ALTER TABLE expenses ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS expenses_idempotency_key_idx ON expenses (idempotency_key);
+"""),
+    # 彙總表、維護觸發器與月報函式，並依既有資料回填
+    (3, "expense rollups", """
+CREATE TABLE IF NOT EXISTS expense_rollups (
+    user_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    category TEXT NOT NULL,
+    total NUMERIC NOT NULL DEFAULT 0,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, month, category)
+);
+
+CREATE INDEX IF NOT EXISTS expense_rollups_month_idx ON expense_rollups (month);
+
+CREATE OR REPLACE FUNCTION apply_expense_rollup()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE expense_rollups
+        SET total = total - OLD.amount, count = count - 1
+        WHERE user_id = OLD.user_id
+          AND month = to_char(OLD.expense_date, 'YYYY-MM')
+          AND category = OLD.category;
+        DELETE FROM expense_rollups
+        WHERE user_id = OLD.user_id
+          AND month = to_char(OLD.expense_date, 'YYYY-MM')
+          AND category = OLD.category
+          AND count <= 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO expense_rollups (user_id, month, category, total, count)
+        VALUES (NEW.user_id, to_char(NEW.expense_date, 'YYYY-MM'), NEW.category, NEW.amount, 1)
+        ON CONFLICT (user_id, month, category) DO UPDATE
+        SET total = expense_rollups.total + EXCLUDED.total,
+            count = expense_rollups.count + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS expenses_rollup ON expenses;
+CREATE TRIGGER expenses_rollup
+AFTER INSERT OR UPDATE OF user_id, amount, category, expense_date OR DELETE ON expenses
+FOR EACH ROW EXECUTE FUNCTION apply_expense_rollup();
+
+CREATE OR REPLACE FUNCTION month_category_totals(p_month TEXT, p_user_id TEXT DEFAULT NULL)
+RETURNS TABLE (category TEXT, total NUMERIC, count BIGINT)
+LANGUAGE sql STABLE
+AS $$
+    SELECT r.category, SUM(r.total) AS total, SUM(r.count)::BIGINT AS count
+    FROM expense_rollups r
+    WHERE r.month = p_month
+      AND (p_user_id IS NULL OR r.user_id = p_user_id)
+    GROUP BY r.category
+    ORDER BY total DESC;
+$$;
+
+LOCK TABLE expenses IN SHARE MODE;
+TRUNCATE expense_rollups;
+INSERT INTO expense_rollups (user_id, month, category, total, count)
+SELECT user_id, to_char(expense_date, 'YYYY-MM') AS month, category,
+       SUM(amount) AS total, COUNT(*) AS count
+FROM expenses
+GROUP BY 1, 2, 3;
+"""),
+    # 先移除重複的類別（保留最早的一筆）再加上唯一限制
+    (4, "categories unique per user", """
+CREATE TABLE IF NOT EXISTS categories (
+    id SERIAL PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    category_name TEXT NOT NULL
+);
+DELETE FROM categories c
+USING categories d
+WHERE c.user_id = d.user_id AND c.category_name = d.category_name AND c.id > d.id;
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'categories_user_category_key') THEN
+        ALTER TABLE categories ADD CONSTRAINT categories_user_category_key UNIQUE (user_id, category_name);
+    END IF;
+END;
+$$;
+"""),
+    # 對應機器人的查詢：用戶＋日期區間（月報明細）、用戶＋項目取最新一筆（刪除）、日期區間（全用戶月報）
+    (5, "expenses query indexes", """
+CREATE INDEX IF NOT EXISTS expenses_user_date_idx ON expenses (user_id, expense_date);
+CREATE INDEX IF NOT EXISTS expenses_user_description_date_idx ON expenses (user_id, description, expense_date DESC);
+CREATE INDEX IF NOT EXISTS expenses_date_idx ON expenses (expense_date);
+"""),
+    # 刪除：一次往返完成「找出最新一筆並刪除」，並回傳被刪除的資料
+    (6, "delete_latest_expense rpc", """
+CREATE OR REPLACE FUNCTION delete_latest_expense(p_user_id TEXT, p_description TEXT)
+RETURNS TABLE (id INTEGER, description TEXT, amount NUMERIC, category TEXT)
+LANGUAGE sql VOLATILE
+AS $$
+    DELETE FROM expenses e
+    WHERE e.id = (
+        SELECT l.id FROM expenses l
+        WHERE l.user_id = p_user_id AND l.description = p_description
+        ORDER BY l.expense_date DESC
+        LIMIT 1
+        FOR UPDATE
+    )
+    RETURNING e.id, e.description, e.amount, e.category;
+$$;
+"""),
+]
+
+# (說明, 查詢, 參數, 必須走索引的資料表)；函式內容對 EXPLAIN 不透明，故直接列出函式內的查詢
+QUERY_PATTERNS = [
+    ("月報個人明細", "SELECT id, description, amount FROM expenses WHERE category = %s AND expense_date >= %s"
+     " AND expense_date <= %s AND id > 0 AND user_id = %s ORDER BY id LIMIT 200",
+     ("三餐", "2025-05-01", "2025-05-31 23:59:59", "U0"), "expenses"),
+    ("月報總和明細", "SELECT id, description, amount FROM expenses WHERE category = %s AND expense_date >= %s"
+     " AND expense_date <= %s AND id > 0 ORDER BY id LIMIT 200",
+     ("三餐", "2025-05-01", "2025-05-31 23:59:59"), "expenses"),
+    ("刪除（delete_latest_expense）", "SELECT id FROM expenses WHERE user_id = %s AND description = %s"
+     " ORDER BY expense_date DESC LIMIT 1", ("U0", "午餐"), "expenses"),
+    ("批次寫入去重", "SELECT 1 FROM expenses WHERE idempotency_key = %s", ("k",), "expenses"),
+    ("類別", "SELECT category_name FROM categories WHERE user_id = %s", ("U0",), "categories"),
+    ("總額", "SELECT total, count FROM expense_rollups WHERE user_id = %s AND month = %s",
+     ("U0", "2025-05"), "expense_rollups"),
+    ("年報", "SELECT month, category, total, count FROM expense_rollups WHERE user_id = %s AND month >= %s"
+     " AND month <= %s", ("U0", "2025-01", "2025-12"), "expense_rollups"),
+    ("匯出", "SELECT id, expense_date, description, amount, category FROM expenses WHERE expense_date >= %s"
+     " AND expense_date <= %s AND id > 0 AND user_id = %s ORDER BY id LIMIT 200",
+     ("2025-05-01", "2025-05-31 23:59:59", "U0"), "expenses"),
+    ("匯出（export.py）", "SELECT id, user_id, description, amount, category, expense_date FROM expenses"
+     " WHERE user_id = %s AND expense_date >= %s AND expense_date < %s ORDER BY expense_date, id",
+     ("U0", "2025-01-01", "2026-01-01"), "expenses"),
+    ("月報統計（month_category_totals）", "SELECT category, SUM(total), SUM(count) FROM expense_rollups"
+     " WHERE month = %s GROUP BY category", ("2025-05",), "expense_rollups"),
+]
+
+
+def ensure_version_table(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+    conn.commit()
+
+
+def applied_versions(conn):
+    ensure_version_table(conn)
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cur.fetchall()}
+
+
+def migrate(conn):
+    """套用尚未執行的版本，回傳本次套用的版本號"""
+    applied = []
+    for version, name, sql in MIGRATIONS:
+        with conn.cursor() as cur:
+            ensure_version_table(conn)
+            # 以 advisory lock 避免多個程序同時遷移
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))")
+            cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+            if cur.fetchone():
+                conn.rollback()
+                continue
+            cur.execute(sql)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        conn.commit()
+        applied.append(version)
+        print(f"✅ {version:03d} {name}")
+    return applied
+
+
+def _scans(plan):
+    """走訪計畫樹，產生 (節點類型, 資料表, 索引)"""
+    # Bitmap Index Scan 只帶索引名稱，資料表在其上層的 Bitmap Heap Scan
+    if plan.get("Relation Name") or plan.get("Index Name"):
+        yield plan["Node Type"], plan.get("Relation Name"), plan.get("Index Name")
+    for child in plan.get("Plans", []):
+        yield from _scans(child)
+
+
+def check(conn):
+    """確認每個查詢在目標資料表上都走索引，回傳失敗數量
+
+    資料量小時規劃器本來就會選擇循序掃描，因此關閉 enable_seqscan，確認的是索引「可以」服務該查詢。
+    """
+    failures = 0
+    for label, sql, params, table in QUERY_PATTERNS:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL enable_seqscan = off")
+            cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cur.fetchone()[0][0]["Plan"]
+        conn.rollback()
+        scans = list(_scans(plan))
+        table_scans = [node_type for node_type, relation, _ in scans if relation == table]
+        if not table_scans or "Seq Scan" in table_scans:
+            failures += 1
+            print(f"❌ {label}: {table} 未使用索引")
+        else:
+            print(f"✅ {label}: {', '.join(sorted({index for _, _, index in scans if index}))}")
+    return failures
+
+
+def main(argv):
+    import psycopg2
+
+    if len(argv) != 2 or argv[1] not in ("migrate", "status", "check"):
+        print("用法：python migrations.py migrate|status|check")
+        return 2
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    try:
+        if argv[1] == "migrate":
+            if not migrate(conn):
+                print("✅ 資料庫已是最新版本")
+            return 0
+        if argv[1] == "status":
+            applied = applied_versions(conn)
+            for version, name, _ in MIGRATIONS:
+                print(f"{'✅' if version in applied else '⬜'} {version:03d} {name}")
+            return 0
+        return 1 if check(conn) else 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,194 @@
+import csv
+import io
+
+import pendulum
+
+from metrics import timed
+from rollups import fetch_year_rollups
+
+# LINE 單則文字訊息上限 5000 字（以 UTF-16 計），一次回覆最多 5 則
+LINE_TEXT_LIMIT = 5000
+LINE_REPLY_MESSAGE_LIMIT = 5
+TRUNCATED_NOTE = "…（內容過長，已截斷）"
+
+
+def text_length(text):
+    """以 UTF-16 code unit 計算長度，與 LINE 的計算方式一致（emoji 佔 2）"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def month_range(target_date):
+    return (
+        target_date.start_of("month").to_iso8601_string(),
+        target_date.end_of("month").to_iso8601_string(),
+    )
+
+
+def fetch_category_totals(supabase, month, user_id=None):
+    """由 expense_rollups 彙總表取得各類別的總額與筆數"""
+    with timed("supabase.month_category_totals"):
+        response = supabase.rpc("month_category_totals", {
+            "p_month": month,
+            "p_user_id": user_id,
+        }).execute()
+    return response.data or []
+
+
+def iter_items(supabase, start, end, user_id=None, category=None, columns="id, description, amount", page_size=200):
+    """以 id 做 keyset 分頁，逐頁取出明細；呼叫端停止讀取時就不再查詢"""
+    last_id = 0
+    while True:
+        query = supabase.table("expenses").select(columns).gte("expense_date", start).lte(
+            "expense_date", end
+        ).gt("id", last_id)
+        if category is not None:
+            query = query.eq("category", category)
+        if user_id is not None:
+            query = query.eq("user_id", user_id)
+        with timed("supabase.expenses.items"):
+            rows = query.order("id").limit(page_size).execute().data or []
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]["id"]
+
+
+def render_month_report(supabase, target_date, user_id=None, pending=()):
+    """逐行產生月報內容；明細在輸出到該類別時才分頁查詢
+
+    pending 為尚未寫入資料庫的記帳（description、amount、category），會併入統計與明細
+    """
+    scope = "個人" if user_id is not None else "全用戶"
+    month_str = target_date.format("YYYY-MM")
+    start, end = month_range(target_date)
+    stats = {
+        row["category"]: {"total": float(row["total"]), "count": row["count"], "pending": []}
+        for row in fetch_category_totals(supabase, month_str, user_id)
+    }
+    for row in pending:
+        cat = stats.setdefault(row["category"], {"total": 0, "count": 0, "pending": []})
+        cat["total"] += row["amount"]
+        cat["count"] += 1
+        cat["pending"].append(row)
+    if not stats:
+        yield f"💰 {month_str} 無支出記錄 ({scope})"
+        return
+
+    total = sum(cat["total"] for cat in stats.values())
+    count = sum(cat["count"] for cat in stats.values())
+    yield f"💰 {month_str} {scope}月度報表 💰"
+    yield "------------------------"
+    yield f"- 總支出：{total:.0f} 元"
+    yield f"- 總筆數：{count} 筆"
+    yield ""
+    yield "📊 按類別統計："
+    for category, cat in stats.items():
+        yield f"- {category}: {cat['total']:.0f} 元 ({cat['count']} 筆)"
+        if cat["count"] > len(cat["pending"]):
+            for item in iter_items(supabase, start, end, user_id, category):
+                yield f"  - {item['description']}: {float(item['amount']):.0f} 元"
+        for item in cat["pending"]:
+            yield f"  - {item['description']}: {item['amount']:.0f} 元"
+    yield ""
+    yield f"⏰ 報表生成時間：{pendulum.now('UTC').format('YYYY-MM-DD HH:mm')} UTC"
+
+
+def render_year_report(supabase, year, user_id, pending=()):
+    """逐行產生年報；整年的月份與類別統計由彙總表一次取得，不逐月查詢明細
+
+    pending 為尚未寫入資料庫的記帳（month、amount、category），會併入統計
+    """
+    rows = [(row["month"], row["category"], float(row["total"]), row["count"]) for row in fetch_year_rollups(supabase, user_id, year)]
+    rows += [(row["month"], row["category"], row["amount"], 1) for row in pending]
+    months, categories = {}, {}
+    for month, category, total, count in rows:
+        for stats, key in ((months, month), (categories, category)):
+            stat = stats.setdefault(key, {"total": 0, "count": 0})
+            stat["total"] += total
+            stat["count"] += count
+    if not months:
+        yield f"📅 {year} 無支出記錄 (個人)"
+        return
+
+    total = sum(stat["total"] for stat in months.values())
+    count = sum(stat["count"] for stat in months.values())
+    yield f"📅 {year} 個人年度報表 📅"
+    yield "------------------------"
+    yield f"- 總支出：{total:.0f} 元"
+    yield f"- 總筆數：{count} 筆"
+    yield f"- 月平均：{total / len(months):.0f} 元（{len(months)} 個月有記錄）"
+    yield ""
+    yield "🗓️ 按月份統計："
+    for month, stat in sorted(months.items()):
+        yield f"- {month}: {stat['total']:.0f} 元 ({stat['count']} 筆)"
+    yield ""
+    yield "📊 按類別統計："
+    for category, stat in sorted(categories.items(), key=lambda item: -item[1]["total"]):
+        yield f"- {category}: {stat['total']:.0f} 元 ({stat['count']} 筆)"
+    yield ""
+    yield f"⏰ 報表生成時間：{pendulum.now('UTC').format('YYYY-MM-DD HH:mm')} UTC"
+
+
+def _csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="").writerow(values)
+    return buffer.getvalue()
+
+
+def render_export(supabase, target_date, user_id, pending=()):
+    """逐行產生該月明細的 CSV；以 keyset 分頁讀取，訊息則數用完時即停止查詢"""
+    month_str = target_date.format("YYYY-MM")
+    start, end = month_range(target_date)
+    items = iter_items(supabase, start, end, user_id, columns="id, expense_date, description, amount, category")
+    yield f"📤 {month_str} 記帳明細 (個人)"
+    yield _csv_line(("日期", "項目", "金額", "類別"))
+    count = 0
+    for item in items:
+        yield _csv_line((item["expense_date"][:10], item["description"], f"{float(item['amount']):.0f}", item["category"]))
+        count += 1
+    for item in pending:
+        yield _csv_line((item["expense_date"][:10], item["description"], f"{item['amount']:.0f}", item["category"]))
+        count += 1
+    if not count:
+        yield "（無記錄）"
+
+
+def paginate(lines, limit=LINE_TEXT_LIMIT, max_messages=LINE_REPLY_MESSAGE_LIMIT):
+    """將逐行產生的文字切成多則訊息；超過則數上限時停止讀取並加上截斷提示"""
+    messages = []
+    current, current_len = "", 0
+    for line in lines:
+        piece = "\n" + line if current else line
+        while True:
+            piece_len = text_length(piece)
+            if piece_len <= limit - current_len:
+                current += piece
+                current_len += piece_len
+                break
+            if current and text_length(line) <= limit:
+                # 放不下時換到下一則訊息
+                messages.append(current)
+                piece = line
+            else:
+                # 單行超過上限時硬切
+                head = _cut(piece, limit - current_len)
+                messages.append(current + head)
+                piece = piece[len(head):]
+            current, current_len = "", 0
+            if len(messages) == max_messages:
+                note = "\n" + TRUNCATED_NOTE
+                messages[-1] = _cut(messages[-1], limit - text_length(note)) + note
+                return messages
+    if current:
+        messages.append(current)
+    return messages
+
+
+def _cut(text, limit):
+    """取出不超過 limit 個 UTF-16 code unit 的前綴"""
+    used = 0
+    for index, char in enumerate(text):
+        used += 2 if ord(char) > 0xFFFF else 1
+        if used > limit:
+            return text[:index]
+    return text
@@ -0,0 +1,97 @@
+"""每位用戶每月、每類別的累計總額與筆數
+
+expense_rollups 由 expenses 上的觸發器在同一筆交易內維護（新增、刪除、修改都會更新；定義見 migrations.py 版本 3），
+總額與月報標題數字只需查詢這張表，不必重新加總原始記帳資料。
+
+命令列工具：
+    python rollups.py verify   # 比對 expense_rollups 與 expenses 的差異
+    python rollups.py rebuild  # 依 expenses 重建 expense_rollups
+連線字串取自環境變數 DATABASE_URL。
+"""
+import os
+import sys
+
+from metrics import timed
+
+# 由原始資料計算的彙總，供比對與重建使用
+_RAW_ROLLUP_SQL = """
+SELECT user_id, to_char(expense_date, 'YYYY-MM') AS month, category,
+       SUM(amount) AS total, COUNT(*) AS count
+FROM expenses
+GROUP BY 1, 2, 3
+"""
+
+VERIFY_SQL = f"""
+SELECT user_id, month, category, r.total, r.count, e.total, e.count
+FROM expense_rollups r
+FULL OUTER JOIN ({_RAW_ROLLUP_SQL}) e USING (user_id, month, category)
+WHERE r.total IS DISTINCT FROM e.total OR r.count IS DISTINCT FROM e.count
+ORDER BY month, user_id, category
+"""
+
+REBUILD_SQL = f"""
+LOCK TABLE expenses IN SHARE MODE;
+TRUNCATE expense_rollups;
+INSERT INTO expense_rollups (user_id, month, category, total, count)
+{_RAW_ROLLUP_SQL};
+"""
+
+
+def fetch_month_total(supabase, user_id, month):
+    """回傳 (總額, 筆數)；只查詢該用戶該月的彙總列"""
+    with timed("supabase.expense_rollups.select"):
+        response = supabase.table("expense_rollups").select("total, count").eq("user_id", user_id).eq(
+            "month", month
+        ).execute()
+    rows = response.data or []
+    return sum(float(row["total"]) for row in rows), sum(row["count"] for row in rows)
+
+
+def fetch_year_rollups(supabase, user_id, year):
+    """一次取得該用戶整年的彙總列（每月、每類別一列）"""
+    with timed("supabase.expense_rollups.year"):
+        response = supabase.table("expense_rollups").select("month, category, total, count").eq(
+            "user_id", user_id
+        ).gte("month", f"{year}-01").lte("month", f"{year}-12").execute()
+    return response.data or []
+
+
+def verify(conn):
+    """列出不一致的彙總列，回傳不一致的數量"""
+    with conn.cursor() as cur:
+        cur.execute(VERIFY_SQL)
+        mismatches = cur.fetchall()
+    for user_id, month, category, rollup_total, rollup_count, raw_total, raw_count in mismatches:
+        print(f"❌ {user_id} {month} {category}: rollup={rollup_total}/{rollup_count} expenses={raw_total}/{raw_count}")
+    return len(mismatches)
+
+
+def rebuild(conn):
+    with conn.cursor() as cur:
+        cur.execute(REBUILD_SQL)
+    conn.commit()
+
+
+def main(argv):
+    import psycopg2
+
+    if len(argv) != 2 or argv[1] not in ("verify", "rebuild"):
+        print("用法：python rollups.py verify|rebuild")
+        return 2
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    try:
+        if argv[1] == "rebuild":
+            rebuild(conn)
+            print("✅ expense_rollups 已重建")
+        mismatches = verify(conn)
+        if mismatches:
+            print(f"❌ 共 {mismatches} 筆彙總不一致，可執行 python rollups.py rebuild")
+            return 1
+        print("✅ expense_rollups 與 expenses 一致")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,267 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spool (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    user_id TEXT NOT NULL,
+    description TEXT NOT NULL,
+    amount REAL NOT NULL,
+    category TEXT NOT NULL,
+    expense_date TEXT NOT NULL,
+    month TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_until REAL NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    first_failed_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS spool_user_month ON spool (user_id, month);
+CREATE INDEX IF NOT EXISTS spool_month ON spool (month);
+
+-- 單獨送出仍被拒絕的記帳，不再重試也不計入總額，需人工處理
+CREATE TABLE IF NOT EXISTS spool_dead (
+    id INTEGER PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    user_id TEXT NOT NULL,
+    description TEXT NOT NULL,
+    amount REAL NOT NULL,
+    category TEXT NOT NULL,
+    expense_date TEXT NOT NULL,
+    month TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    failed_at REAL NOT NULL
+);
+"""
+
+_ROW_FIELDS = ("idempotency_key", "user_id", "description", "amount", "category", "expense_date")
+
+
+class ExpenseSpool:
+    """記帳寫入緩衝區：先寫入本地 SQLite（WAL），再由背景執行緒合併成批次寫入 Supabase
+
+    - 每筆記帳帶有 idempotency_key，重試或多個 worker 重複送出時由資料庫的唯一鍵去重
+    - 多個 worker 共用同一個檔案，以 claimed_until 認領送出中的批次，避免同時送出相同資料；
+      失敗的記帳以 next_attempt_at 退避，退避期間仍可被刪除
+    - 同一批連續失敗 split_after 次後，每次重試減半批次大小，直到有問題的記帳單獨送出；
+      單獨送出失敗且累計 max_attempts 次、而開始失敗後有其他記帳成功寫入（排除資料庫整體故障）時移到 spool_dead
+    - 尚未寫入 Supabase 的記帳可透過 pending_* 查詢，讓總額與月報立即反映
+    """
+
+    def __init__(self, path, insert_rows, batch_size=500, linger=0.2, poll_interval=1.0, lease=30, max_backoff=60,
+                 split_after=3, max_attempts=12, clock=time.time):
+        self.path = path
+        self._insert_rows = insert_rows
+        self.batch_size = batch_size
+        self.split_after = split_after
+        self.max_attempts = max_attempts
+        self._clock = clock
+        self.linger = linger
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_backoff = max_backoff
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._last_success = 0.0
+        # 建立資料表後即關閉，連線在各執行緒第一次使用時才建立（避免跨 fork 共用）
+        conn = self._open()
+        conn.executescript(_SCHEMA)
+        conn.close()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._conn())
+
+    def append(self, rows):
+        """寫入本地緩衝區（已 fsync），回傳後即可回覆用戶"""
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO spool (idempotency_key, user_id, description, amount, category, expense_date, month)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (str(uuid.uuid4()), row["user_id"], row["description"], row["amount"], row["category"],
+                     row["expense_date"], row["expense_date"][:7])
+                    for row in rows
+                ],
+            )
+        self._wakeup.set()
+
+    def pending_total(self, user_id, month):
+        """尚未寫入 Supabase 的 (總額, 筆數)"""
+        total, count = self._conn().execute(
+            "SELECT COALESCE(SUM(amount), 0), COUNT(*) FROM spool WHERE user_id = ? AND month = ?",
+            (user_id, month),
+        ).fetchone()
+        return total, count
+
+    def pending_rows(self, month, user_id=None):
+        """尚未寫入 Supabase 的記帳明細（依寫入順序）"""
+        return self.pending_rows_between(month, month, user_id)
+
+    def pending_rows_between(self, start_month, end_month, user_id=None):
+        """start_month 至 end_month（含）之間尚未寫入 Supabase 的記帳明細（依寫入順序）"""
+        query = "SELECT month, expense_date, description, amount, category FROM spool WHERE month >= ? AND month <= ?"
+        params = [start_month, end_month]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        return [dict(row) for row in self._conn().execute(query + " ORDER BY id", params)]
+
+    def discard_latest(self, user_id, description, wait=5.0):
+        """刪除最新一筆尚未寫入 Supabase 的同名記帳，找不到時回傳 None
+
+        等待重試的記帳也可刪除；最新一筆正在送出時最多等待 wait 秒，
+        送出成功則回傳 None（由呼叫端刪除資料庫中的那一筆），仍在送出則請用戶稍後再試
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            with self._transaction() as conn:
+                row = conn.execute(
+                    "SELECT id, amount, category, claimed_until FROM spool WHERE user_id = ? AND description = ?"
+                    " ORDER BY id DESC LIMIT 1",
+                    (user_id, description),
+                ).fetchone()
+                if row is None:
+                    return None
+                if row["claimed_until"] < self._clock():
+                    conn.execute("DELETE FROM spool WHERE id = ?", (row["id"],))
+                    return {"id": row["id"], "amount": row["amount"], "category": row["category"]}
+            if time.monotonic() >= deadline:
+                raise ValueError("這筆記帳正在寫入資料庫，請稍後再刪除")
+            time.sleep(0.05)
+
+    def dead_count(self):
+        """已移到 spool_dead 的記帳筆數"""
+        return self._conn().execute("SELECT COUNT(*) FROM spool_dead").fetchone()[0]
+
+    def flush_once(self):
+        """認領一批記帳並寫入 Supabase，回傳成功送出的筆數；失敗時依次數退避"""
+        now = self._clock()
+        with self._transaction() as conn:
+            head = conn.execute(
+                "SELECT attempts FROM spool WHERE claimed_until < ? AND next_attempt_at <= ? ORDER BY id LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if head is None:
+                return 0
+            limit = max(1, self.batch_size >> max(0, head["attempts"] - self.split_after + 1))
+            rows = conn.execute(
+                "SELECT * FROM spool WHERE claimed_until < ? AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (now, now, limit),
+            ).fetchall()
+            ids = [row["id"] for row in rows]
+            conn.execute(
+                f"UPDATE spool SET claimed_until = ? WHERE id IN ({','.join('?' * len(ids))})",
+                [now + self.lease, *ids],
+            )
+
+        try:
+            self._insert_rows([{field: row[field] for field in _ROW_FIELDS} for row in rows])
+        except Exception as e:
+            self._record_failure(rows, e)
+            raise
+
+        self._last_success = self._clock()
+        with self._transaction() as conn:
+            conn.execute(f"DELETE FROM spool WHERE id IN ({','.join('?' * len(ids))})", ids)
+        return len(rows)
+
+    def _record_failure(self, rows, error):
+        now = self._clock()
+        attempts = max(row["attempts"] for row in rows) + 1
+        ids = [row["id"] for row in rows]
+        row = rows[0]
+        with self._transaction() as conn:
+            # 單獨送出仍失敗，且開始失敗後有其他記帳寫入成功：判定為這筆資料本身的問題
+            if len(rows) == 1 and attempts >= self.max_attempts and self._last_success > row["first_failed_at"]:
+                logger.error("Spool row %s moved to spool_dead after %d attempts: %s", row["idempotency_key"], attempts, error)
+                conn.execute(
+                    "INSERT OR REPLACE INTO spool_dead (id, idempotency_key, user_id, description, amount, category,"
+                    " expense_date, month, attempts, last_error, failed_at) SELECT id, idempotency_key, user_id,"
+                    " description, amount, category, expense_date, month, ?, ?, ? FROM spool WHERE id = ?",
+                    (attempts, str(error), now, row["id"]),
+                )
+                conn.execute("DELETE FROM spool WHERE id = ?", (row["id"],))
+                return
+            logger.error("Spool flush failed (%d rows, attempt %d): %s", len(rows), attempts, error)
+            # 拆批時只讓前半退避，後半立即重試，兩半分開送出才能找出有問題的那一筆
+            delayed = ids[:len(ids) // 2] if len(ids) > 1 and attempts >= self.split_after else ids
+            for batch, next_attempt_at in ((delayed, now + min(self.max_backoff, 2 ** attempts)), (ids[len(delayed):], now)):
+                if batch:
+                    conn.execute(
+                        "UPDATE spool SET attempts = attempts + 1, claimed_until = 0, next_attempt_at = ?,"
+                        " first_failed_at = CASE WHEN first_failed_at = 0 THEN ? ELSE first_failed_at END,"
+                        f" last_error = ? WHERE id IN ({','.join('?' * len(batch))})",
+                        [next_attempt_at, now, str(error), *batch],
+                    )
+
+    def flush(self, deadline=None):
+        """持續送出直到緩衝區清空、送出失敗或超過 deadline（time.monotonic()）"""
+        flushed = 0
+        while deadline is None or time.monotonic() < deadline:
+            try:
+                count = self.flush_once()
+            except Exception:
+                return flushed
+            if count == 0:
+                return flushed
+            flushed += count
+        return flushed
+
+    def _run(self):
+        while not self._stopping.is_set():
+            # 有新資料時稍等 linger 秒，讓多個事件的記帳合併成一批；另定期重試失敗的批次
+            if self._wakeup.wait(timeout=self.poll_interval):
+                self._stopping.wait(self.linger)
+            self._wakeup.clear()
+            self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="expense-spool", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """停止背景執行緒並在 timeout 秒內嘗試送出剩餘資料（未送出的保留在檔案中，下次啟動再送）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush(deadline)
+
+
+class _Transaction:
+    """以 BEGIN IMMEDIATE 包住一段操作，離開時 COMMIT（例外時 ROLLBACK）"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+# 模組都放在專案根目錄
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fakes import FakeDatabase, start_postgrest  # noqa: E402
+
+# 格式正確的假 JWT，僅供 supabase client 初始化
+SUPABASE_KEY = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJyb2xlIjoiYW5vbiJ9.YmVuY2g"
+
+
+@pytest.fixture
+def fake_db():
+    return FakeDatabase()
+
+
+@pytest.fixture
+def supabase(fake_db):
+    """連到本機模擬 PostgREST 的 supabase client"""
+    supabase = pytest.importorskip("supabase")
+    import httpx
+
+    server = start_postgrest(fake_db)
+    http_client = httpx.Client()
+    try:
+        yield supabase.create_client(
+            f"http://127.0.0.1:{server.server_port}", SUPABASE_KEY, options=supabase.ClientOptions(httpx_client=http_client)
+        )
+    finally:
+        http_client.close()
+        server.shutdown()
+        server.server_close()
+
+
+def expense(user_id="U1", description="午餐", amount=100.0, category="三餐", date="2025-05-01T12:00:00+00:00"):
+    return {"user_id": user_id, "description": description, "amount": amount, "category": category, "expense_date": date}
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from cache import LocalEventIdStore, LocalInvalidationBackend, RedisEventIdStore, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_set_and_expiry():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    clock.now = 5
+    assert cache.get("a") is None
+    assert cache.stats() == {"size": 0, "hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_lru_eviction_keeps_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60, clock=FakeClock())
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.evictions == 1
+
+
+def test_peek_does_not_count_or_reorder():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=5, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.peek("a") == 1
+    assert cache.peek("missing") is None
+    cache.set("c", 3)
+    assert cache.peek("a") is None
+    clock.now = 5
+    assert cache.peek("b") is None
+    assert cache.stats() == {"size": 2, "hits": 0, "misses": 0, "evictions": 1}
+
+
+def test_add_only_when_absent_or_expired():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+    assert cache.add("a") is True
+    assert cache.add("a") is False
+    clock.now = 5
+    assert cache.add("a") is True
+
+
+def test_local_invalidation_pops_subscribed_cache():
+    cache = TTLCache(clock=FakeClock())
+    backend = LocalInvalidationBackend()
+    backend.subscribe(cache.pop)
+    cache.set("U1", {"三餐"})
+    backend.publish("U1")
+    assert cache.get("U1") is None
+
+
+def test_event_id_store_claims_once_until_released():
+    async def main():
+        store = LocalEventIdStore(maxsize=10, ttl=60)
+        assert await store.claim(["e1", "e2"]) == [True, True]
+        assert await store.claim(["e1", "e3"]) == [False, True]
+        await store.release(["e1"])
+        assert await store.claim(["e1"]) == [True]
+
+    asyncio.run(main())
+
+
+def test_redis_event_id_store_fails_open():
+    pytest.importorskip("redis")
+
+    async def main():
+        store = RedisEventIdStore("redis://127.0.0.1:1/0")
+        assert await store.claim(["e1", "e2"]) == [True, True]
+        await store.release(["e1"])
+
+    asyncio.run(main())
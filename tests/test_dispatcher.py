@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from dispatcher import EventDispatcher, ordering_key
+
+
+def event(user_id, text):
+    return SimpleNamespace(source=SimpleNamespace(user_id=user_id), text=text)
+
+
+def test_ordering_key_prefers_group_then_room_then_user():
+    assert ordering_key(event("U1", "")) == "U1"
+    assert ordering_key(SimpleNamespace(source=SimpleNamespace(user_id="U1", group_id="G1"))) == "G1"
+    assert ordering_key(SimpleNamespace(source=SimpleNamespace(user_id="U1", room_id="R1"))) == "R1"
+    assert ordering_key(SimpleNamespace()) == ""
+
+
+def test_events_from_same_user_run_in_order():
+    handled = []
+    lock = threading.Lock()
+
+    def handle(e):
+        time.sleep(0.01 if e.text == "1" else 0)
+        with lock:
+            handled.append((e.source.user_id, e.text))
+
+    async def main():
+        dispatcher = EventDispatcher(handle, max_workers=4)
+        assert dispatcher.try_submit([event("U1", "1"), event("U1", "2"), event("U2", "1")])
+        await dispatcher.drain(timeout=5)
+
+    asyncio.run(main())
+    assert [text for user_id, text in handled if user_id == "U1"] == ["1", "2"]
+    assert len(handled) == 3
+
+
+def test_rejects_when_full_or_closed():
+    release = threading.Event()
+
+    async def main():
+        dispatcher = EventDispatcher(lambda e: release.wait(5), max_pending=2)
+        assert dispatcher.try_submit([event("U1", "1"), event("U2", "1")])
+        assert not dispatcher.try_submit([event("U3", "1")])
+        assert dispatcher.pending == 2
+        release.set()
+        await dispatcher.drain(timeout=5)
+        assert dispatcher.pending == 0
+        assert not dispatcher.try_submit([event("U1", "2")])
+
+    asyncio.run(main())
+
+
+def test_handler_errors_do_not_stop_the_queue():
+    handled = []
+
+    def handle(e):
+        if e.text == "boom":
+            raise RuntimeError("boom")
+        handled.append(e.text)
+
+    async def main():
+        dispatcher = EventDispatcher(handle)
+        dispatcher.try_submit([event("U1", "boom"), event("U1", "ok")])
+        await dispatcher.drain(timeout=5)
+
+    asyncio.run(main())
+    assert handled == ["ok"]
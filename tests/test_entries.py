@@ -0,0 +1,39 @@
+import pytest
+
+from entries import MAX_BULK_LINES, parse_bulk, parse_expense
+
+CATEGORIES = ["三餐", "飲料"]
+
+
+def test_parse_expense():
+    assert parse_expense(["午餐", "120", "三餐"], CATEGORIES) == ("午餐", 120.0, "三餐")
+
+
+@pytest.mark.parametrize("tokens", [
+    ["午餐", "120"],
+    ["午餐", "abc", "三餐"],
+    ["午餐", "0", "三餐"],
+    ["午餐", "120", "加油"],
+    ["x" * 51, "120", "三餐"],
+])
+def test_parse_expense_rejects_invalid_input(tokens):
+    with pytest.raises(ValueError):
+        parse_expense(tokens, CATEGORIES)
+
+
+def test_parse_bulk_collects_entries_and_errors_by_line():
+    text = "記帳\n午餐 120 三餐\n\n咖啡 abc 飲料\n記帳 奶茶 60 飲料"
+    entries, errors = parse_bulk(text, CATEGORIES)
+    assert entries == [("午餐", 120.0, "三餐"), ("奶茶", 60.0, "飲料")]
+    assert [line_no for line_no, _ in errors] == [3]
+
+
+def test_parse_bulk_all_invalid():
+    entries, errors = parse_bulk("記帳\n午餐 120\n咖啡 -1 飲料", CATEGORIES)
+    assert entries == []
+    assert len(errors) == 2
+
+
+def test_parse_bulk_limits_line_count():
+    with pytest.raises(ValueError):
+        parse_bulk("記帳\n" + "\n".join(["午餐 1 三餐"] * (MAX_BULK_LINES + 1)), CATEGORIES)
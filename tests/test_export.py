@@ -0,0 +1,32 @@
+from export import summarize_by_month
+
+
+def row(date, amount, category="三餐"):
+    return {"expense_date": date, "amount": amount, "category": category}
+
+
+def test_each_month_is_summarized_when_the_next_begins():
+    rows = [
+        row("2025-01-31T23:59:59+00:00", 100),
+        row("2025-02-01T00:00:00+00:00", 30, "飲料"),
+        row("2025-02-28T12:00:00+00:00", 20),
+        row("2025-02-28T13:00:00+00:00", 5, "飲料"),
+    ]
+    assert list(summarize_by_month(rows)) == [
+        ("2025-01", 100, 1, {"三餐": 100}),
+        ("2025-02", 55, 3, {"飲料": 35, "三餐": 20}),
+    ]
+
+
+def test_yields_before_reading_the_rest():
+    def rows():
+        yield row("2025-01-01T00:00:00+00:00", 1)
+        yield row("2025-02-01T00:00:00+00:00", 2)
+        raise AssertionError("不應讀到這裡")
+
+    summaries = summarize_by_month(rows())
+    assert next(summaries)[0] == "2025-01"
+
+
+def test_no_rows():
+    assert list(summarize_by_month([])) == []
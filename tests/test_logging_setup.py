@@ -0,0 +1,32 @@
+import logging
+import sys
+
+from logging_setup import KeyValueFormatter, current_user_id
+from metrics import current_command
+
+
+def record(msg, *args, exc_info=None):
+    return logging.LogRecord("app", logging.INFO, __file__, 1, msg, args, exc_info)
+
+
+def test_fields_include_command_and_user():
+    command_token = current_command.set("record")
+    user_token = current_user_id.set("U1")
+    try:
+        line = KeyValueFormatter().format(record("User %s sent: %s", "U1", "記帳 午餐 100 三餐"))
+    finally:
+        current_user_id.reset(user_token)
+        current_command.reset(command_token)
+    assert " level=INFO logger=app command=record user_id=U1 " in line
+    assert line.endswith('msg="User U1 sent: 記帳 午餐 100 三餐"')
+
+
+def test_values_are_escaped_onto_one_line():
+    try:
+        raise RuntimeError("boom")
+    except RuntimeError:
+        line = KeyValueFormatter().format(record('say "hi"\nbye', exc_info=sys.exc_info()))
+    assert "\n" not in line
+    assert 'msg="say \\"hi\\"\\nbye"' in line
+    assert "user_id=" not in line
+    assert "RuntimeError: boom" in line
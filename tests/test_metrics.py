@@ -0,0 +1,61 @@
+import json
+import os
+
+from metrics import Registry
+
+DEAD_PID = 2 ** 22 + 12345
+
+
+def registry_with_metrics():
+    registry = Registry()
+    counter = registry.counter("jobs_total", "Jobs", ("kind",))
+    histogram = registry.histogram("job_seconds", "Job time", buckets=(0.1, 1.0))
+    registry.callback("queue_depth", "Queue depth", lambda: 3)
+    return registry, counter, histogram
+
+
+def test_render_single_process():
+    registry, counter, histogram = registry_with_metrics()
+    counter.inc(kind="a")
+    histogram.observe(0.5)
+    text = registry.render()
+    assert 'jobs_total{kind="a"} 1' in text
+    assert 'job_seconds_bucket{le="1.0"} 1' in text
+    assert "queue_depth 3" in text
+
+
+def write_other_process(directory, pid, registry):
+    with open(os.path.join(directory, f"{pid}.json"), "w", encoding="utf-8") as f:
+        json.dump(registry.collect(), f)
+
+
+def test_multiprocess_sums_counters_and_labels_gauges(tmp_path):
+    registry, counter, histogram = registry_with_metrics()
+    registry.enable_multiprocess(str(tmp_path))
+    counter.inc(kind="a")
+    histogram.observe(0.5)
+
+    other, other_counter, other_histogram = registry_with_metrics()
+    other_counter.inc(2, kind="a")
+    other_histogram.observe(0.05)
+    write_other_process(str(tmp_path), os.getppid(), other)
+    write_other_process(str(tmp_path), DEAD_PID, other)
+
+    text = registry.render()
+    # 已結束的 worker 仍計入 counter 與 histogram
+    assert 'jobs_total{kind="a"} 5' in text
+    assert 'job_seconds_bucket{le="0.1"} 2' in text
+    assert 'job_seconds_count 3' in text
+    # gauge 只列出存活的 worker
+    assert f'queue_depth{{pid="{os.getpid()}"}} 3' in text
+    assert f'queue_depth{{pid="{os.getppid()}"}} 3' in text
+    assert f'pid="{DEAD_PID}"' not in text
+    assert text.count("# TYPE jobs_total counter") == 1
+
+
+def test_render_writes_own_snapshot(tmp_path):
+    registry, counter, _ = registry_with_metrics()
+    registry.enable_multiprocess(str(tmp_path))
+    counter.inc(kind="a")
+    registry.render()
+    assert os.path.exists(tmp_path / f"{os.getpid()}.json")
@@ -0,0 +1,129 @@
+import pendulum
+
+from conftest import expense
+from reports import (LINE_REPLY_MESSAGE_LIMIT, TRUNCATED_NOTE, iter_items, paginate, render_export,
+                     render_year_report, text_length)
+
+
+def test_short_lines_fit_in_one_message():
+    assert paginate(["a", "b", "c"]) == ["a\nb\nc"]
+
+
+def test_empty_input():
+    assert paginate([]) == []
+
+
+def test_exact_fit_stays_in_one_message():
+    # "aaaa" + "\n" + "bbbbb" 剛好 10 字
+    assert paginate(["aaaa", "bbbbb"], limit=10) == ["aaaa\nbbbbb"]
+
+
+def test_line_that_does_not_fit_starts_next_message():
+    assert paginate(["aaaa", "bbbbbb"], limit=10) == ["aaaa", "bbbbbb"]
+
+
+def test_over_long_line_is_split():
+    messages = paginate(["x" * 25], limit=10)
+    assert messages == ["x" * 10, "x" * 10, "x" * 5]
+
+
+def test_length_counts_utf16_units():
+    # emoji 佔 2 個 UTF-16 code unit，不可從中間切開
+    messages = paginate(["💰" * 6], limit=5)
+    assert messages == ["💰💰", "💰💰", "💰💰"]
+    assert all(text_length(message) <= 5 for message in messages)
+
+
+def test_truncates_after_message_limit():
+    limit = 40
+    messages = paginate((f"line {index:04d} " + "x" * 20 for index in range(100)), limit=limit)
+    assert len(messages) == LINE_REPLY_MESSAGE_LIMIT
+    assert messages[-1].endswith(TRUNCATED_NOTE)
+    assert all(text_length(message) <= limit for message in messages)
+
+
+def test_stops_reading_lines_once_truncated():
+    consumed = []
+
+    def lines():
+        for index in range(1000):
+            consumed.append(index)
+            yield "x" * 30
+
+    paginate(lines(), limit=40, max_messages=2)
+    assert len(consumed) < 10
+
+
+def seed(fake_db, rows):
+    with fake_db.lock:
+        for row in rows:
+            fake_db.insert_expense(row)
+
+
+def test_iter_items_pages_by_id(supabase, fake_db):
+    seed(fake_db, [expense(description=f"item{index}", category="三餐" if index % 3 else "飲料") for index in range(10)])
+    start, end = "2025-05-01T00:00:00Z", "2025-05-31T23:59:59Z"
+
+    items = list(iter_items(supabase, start, end, "U1", page_size=3))
+    assert [item["description"] for item in items] == [f"item{index}" for index in range(10)]
+    items = list(iter_items(supabase, start, end, "U1", category="飲料", page_size=2))
+    assert [item["description"] for item in items] == ["item0", "item3", "item6", "item9"]
+
+
+def test_iter_items_stops_querying_when_reader_stops(supabase, fake_db, monkeypatch):
+    seed(fake_db, [expense(description=f"item{index}") for index in range(10)])
+    queries = []
+    rows = fake_db.rows
+    monkeypatch.setattr(fake_db, "rows", lambda table: queries.append(table) or rows(table))
+
+    items = iter_items(supabase, "2025-05-01T00:00:00Z", "2025-05-31T23:59:59Z", "U1", page_size=3)
+    assert [next(items)["description"] for _ in range(4)] == ["item0", "item1", "item2", "item3"]
+    assert queries == ["expenses", "expenses"]
+
+
+def test_year_report_merges_rollups_and_pending(supabase, fake_db):
+    seed(fake_db, [
+        expense(amount=100, date="2025-01-31T23:59:59+00:00"),
+        expense(amount=50, category="飲料", date="2025-02-01T00:00:00+00:00"),
+        # 前後年度與其他用戶不列入
+        expense(amount=999, date="2024-12-31T23:59:59+00:00"),
+        expense(amount=999, date="2026-01-01T00:00:00+00:00"),
+        expense(user_id="U2", amount=999, date="2025-01-15T12:00:00+00:00"),
+    ])
+    pending = [{"month": "2025-02", "amount": 30.0, "category": "三餐"}]
+
+    lines = list(render_year_report(supabase, 2025, "U1", pending))
+    assert lines[:5] == ["📅 2025 個人年度報表 📅", "------------------------", "- 總支出：180 元", "- 總筆數：3 筆",
+                         "- 月平均：90 元（2 個月有記錄）"]
+    assert "- 2025-01: 100 元 (1 筆)" in lines
+    assert "- 2025-02: 80 元 (2 筆)" in lines
+    assert lines.index("- 三餐: 130 元 (2 筆)") < lines.index("- 飲料: 50 元 (1 筆)")
+
+
+def test_year_report_without_records(supabase, fake_db):
+    seed(fake_db, [expense(date="2024-06-01T12:00:00+00:00")])
+    assert list(render_year_report(supabase, 2025, "U1")) == ["📅 2025 無支出記錄 (個人)"]
+
+
+def test_export_covers_the_whole_month_and_pending(supabase, fake_db):
+    seed(fake_db, [
+        expense(description="月初", date="2025-05-01T00:00:00+00:00"),
+        expense(description="月底", amount=20, category="飲料", date="2025-05-31T23:59:59+00:00"),
+        expense(description="上月", date="2025-04-30T23:59:59+00:00"),
+        expense(description="下月", date="2025-06-01T00:00:00+00:00"),
+        expense(user_id="U2", description="他人", date="2025-05-10T12:00:00+00:00"),
+    ])
+    pending = [{"expense_date": "2025-05-31T12:00:00+00:00", "description": "待送, 出", "amount": 5.0, "category": "三餐"}]
+
+    lines = list(render_export(supabase, pendulum.datetime(2025, 5, 15), "U1", pending))
+    assert lines == [
+        "📤 2025-05 記帳明細 (個人)",
+        "日期,項目,金額,類別",
+        "2025-05-01,月初,100,三餐",
+        "2025-05-31,月底,20,飲料",
+        '2025-05-31,"待送, 出",5,三餐',
+    ]
+
+
+def test_export_without_records(supabase):
+    assert list(render_export(supabase, pendulum.datetime(2025, 5, 1), "U1"))[-1] == "（無記錄）"
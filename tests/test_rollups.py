@@ -0,0 +1,16 @@
+from conftest import expense
+from rollups import fetch_month_total
+
+
+def test_month_total_sums_categories_for_one_user(supabase, fake_db):
+    with fake_db.lock:
+        for row in [
+            expense(amount=100, date="2025-05-01T00:00:00+00:00"),
+            expense(amount=30, category="飲料", date="2025-05-31T23:59:59+00:00"),
+            expense(amount=999, date="2025-06-01T00:00:00+00:00"),
+            expense(user_id="U2", amount=999),
+        ]:
+            fake_db.insert_expense(row)
+
+    assert fetch_month_total(supabase, "U1", "2025-05") == (130, 2)
+    assert fetch_month_total(supabase, "U1", "2025-04") == (0, 0)
@@ -0,0 +1,179 @@
+import threading
+import time
+
+import pytest
+
+from spool import ExpenseSpool
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSink:
+    """模擬 Supabase：以 idempotency_key 去重，可指定失敗條件"""
+
+    def __init__(self):
+        self.rows = {}
+        self.calls = []
+        self.fail = None
+
+    def __call__(self, rows):
+        self.calls.append([row["description"] for row in rows])
+        if self.fail is not None and self.fail(rows):
+            raise RuntimeError("rejected")
+        for row in rows:
+            self.rows.setdefault(row["idempotency_key"], row)
+
+
+def row(description="午餐", amount=100.0, user_id="U1", category="三餐", month="2025-05"):
+    return {
+        "user_id": user_id,
+        "description": description,
+        "amount": amount,
+        "category": category,
+        "expense_date": f"{month}-01T12:00:00+00:00",
+    }
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def sink():
+    return FakeSink()
+
+
+@pytest.fixture
+def spool(tmp_path, sink, clock):
+    return ExpenseSpool(str(tmp_path / "spool.db"), sink, batch_size=8, clock=clock)
+
+
+def test_append_counts_as_pending(spool):
+    spool.append([row("午餐", 100), row("咖啡", 50, category="飲料"), row("晚餐", 80, user_id="U2")])
+
+    assert spool.pending_total("U1", "2025-05") == (150, 2)
+    assert spool.pending_total("U1", "2025-06") == (0, 0)
+    assert [r["description"] for r in spool.pending_rows("2025-05")] == ["午餐", "咖啡", "晚餐"]
+    assert [r["description"] for r in spool.pending_rows("2025-05", "U2")] == ["晚餐"]
+
+
+def test_flush_writes_and_removes_rows(spool, sink):
+    spool.append([row("午餐"), row("咖啡")])
+
+    assert spool.flush_once() == 2
+    assert spool.flush_once() == 0
+    assert spool.pending_total("U1", "2025-05") == (0, 0)
+    assert sorted(r["description"] for r in sink.rows.values()) == ["午餐", "咖啡"]
+    assert all(r["idempotency_key"] for r in sink.rows.values())
+
+
+def test_claimed_rows_are_not_flushed_or_discarded(spool, sink):
+    spool.append([row("午餐")])
+    seen = {}
+
+    def during_send(rows):
+        seen["second_flush"] = spool.flush_once()
+        with pytest.raises(ValueError):
+            spool.discard_latest("U1", "午餐", wait=0)
+
+    sink.fail = lambda rows: during_send(rows)
+    assert spool.flush_once() == 1
+    assert seen["second_flush"] == 0
+
+
+def test_discard_waits_for_in_flight_row(spool, sink):
+    spool.append([row("午餐")])
+    results = []
+
+    def slow_send(rows):
+        thread = threading.Thread(target=lambda: results.append(spool.discard_latest("U1", "午餐")))
+        thread.start()
+        time.sleep(0.2)
+        return False
+
+    sink.fail = slow_send
+    assert spool.flush_once() == 1
+    # 送出成功後才回傳 None，交由呼叫端刪除資料庫中的那一筆
+    while not results:
+        time.sleep(0.01)
+    assert results == [None]
+
+
+def test_failed_rows_back_off_and_can_still_be_discarded(spool, sink, clock):
+    sink.fail = lambda rows: True
+    spool.append([row("午餐", 100)])
+
+    with pytest.raises(RuntimeError):
+        spool.flush_once()
+    assert spool.flush_once() == 0
+    assert spool.pending_total("U1", "2025-05") == (100, 1)
+
+    assert spool.discard_latest("U1", "午餐") == {"id": 1, "amount": 100, "category": "三餐"}
+    assert spool.pending_total("U1", "2025-05") == (0, 0)
+    assert spool.discard_latest("U1", "午餐") is None
+
+
+def test_retry_after_backoff_resends_same_idempotency_key(spool, sink, clock):
+    sent_keys = []
+
+    def lost_response(rows):
+        # 資料庫已寫入但回應遺失
+        sent_keys.extend(r["idempotency_key"] for r in rows)
+        for r in rows:
+            sink.rows.setdefault(r["idempotency_key"], r)
+        return len(sent_keys) == 1
+
+    sink.fail = lost_response
+    spool.append([row("午餐")])
+    with pytest.raises(RuntimeError):
+        spool.flush_once()
+
+    clock.now += 60
+    assert spool.flush_once() == 1
+    assert sent_keys[0] == sent_keys[1]
+    assert len(sink.rows) == 1
+
+
+def test_rejected_row_is_isolated_and_dead_lettered(spool, sink, clock):
+    sink.fail = lambda rows: any(r["description"] == "bad" for r in rows)
+    spool.append([row("bad" if index == 5 else f"item{index}", 1) for index in range(20)])
+
+    for _ in range(100):
+        try:
+            spool.flush_once()
+        except RuntimeError:
+            pass
+        clock.now += 5
+
+    assert len(sink.rows) == 19
+    assert spool.dead_count() == 1
+    assert spool.pending_total("U1", "2025-05") == (0, 0)
+
+
+def test_outage_never_dead_letters(spool, sink, clock):
+    sink.fail = lambda rows: True
+    spool.append([row(f"item{index}", 1) for index in range(20)])
+
+    for _ in range(200):
+        try:
+            spool.flush_once()
+        except RuntimeError:
+            pass
+        clock.now += 60
+
+    assert spool.dead_count() == 0
+    assert spool.pending_total("U1", "2025-05") == (20, 20)
+
+
+def test_stop_gives_up_after_timeout(spool, sink):
+    spool.append([row(f"item{index}") for index in range(20)])
+    spool.stop(timeout=0)
+    assert sink.calls == []
+    assert spool.pending_total("U1", "2025-05") == (2000, 20)